@@ -7,16 +7,43 @@ Usage:
     uv run python -m src.app
 """
 
+import asyncio
+import functools
+import hashlib
+import json
 import os
-from typing import Any, Callable
+import threading
+import time
+import unicodedata
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Iterator, Sequence
 
 import gradio as gr
 
-from src.pipelines import build_lab_results_output, build_prescription_output
-from src.inference import get_backend
-from src.interactions import Interaction, check_interactions
+from src.cache import DiskTextCache, LRUCache
+from src.inference import (
+    get_backend,
+    parse_lab_results_response,
+    parse_prescription_response,
+)
+from src.inference.batcher import BATCH_MAX_SIZE
+from src.inference.constants import (
+    FLASH_ATTN_ENV_VAR,
+    MAX_NEW_TOKENS_LABS,
+    MAX_NEW_TOKENS_PRESCRIPTION,
+    MODEL_ID,
+    QUANTIZATION_ENV_VAR,
+    SKIP_THINKING_ENV_VAR,
+)
+from src.inference.utils import downscale_image_bytes
+from src.interactions import Interaction, check_interactions, order_interactions
 from src.logger import get_logger, log_timing
 from src.models import LabResultExtraction, PrescriptionExtraction
+from src.prompts import LAB_RESULTS_PROMPT, PRESCRIPTION_PROMPT, SYSTEM_INSTRUCTION
+
+if TYPE_CHECKING:
+    from src.pipelines import PrescriptionPipelineResult
 
 logger = get_logger("src.app")
 
@@ -27,55 +54,292 @@ DEFAULT_BACKEND_MODE = "auto"
 
 # Backends are initialized lazily and cached by name
 _backend_cache: dict[str, Any] = {}
+_backend_cache_lock = threading.Lock()
+
+# After BACKEND_FAILURE_THRESHOLD consecutive errors a backend is skipped for
+# an exponentially growing cooldown, so a known-dead endpoint does not add its
+# timeout to every request before the fallback runs
+BACKEND_FAILURE_THRESHOLD = 2
+BACKEND_MAX_COOLDOWN_SECONDS = 60.0
+# backend name -> (consecutive failures, monotonic time it may be retried)
+_backend_failures: dict[str, tuple[int, float]] = {}
+
+# Re-uploads of the same photo skip inference: results are keyed by image content
+EXTRACTION_CACHE_SIZE = 128
+_extraction_cache: LRUCache[tuple[str, str], Any] = LRUCache(EXTRACTION_CACHE_SIZE)
+
+# Set EXTRACTION_CACHE_DIR (e.g. ~/.cache/misalud) to also keep the raw model
+# responses on disk, so cache hits survive app restarts. They contain medical
+# data, so the directory is bounded by entry count and age
+EXTRACTION_CACHE_DIR_ENV_VAR = "EXTRACTION_CACHE_DIR"
+EXTRACTION_DISK_CACHE_MAX_ENTRIES = 256
+EXTRACTION_DISK_CACHE_MAX_AGE_SECONDS = 7 * 24 * 60 * 60
+_RESPONSE_PARSERS: dict[str, Callable[[str], Any]] = {
+    "extract_prescription": parse_prescription_response,
+    "extract_lab_results": parse_lab_results_response,
+}
+
+# Disk entries are also keyed by what produced them, so changing the model,
+# a prompt, a token budget or an output-changing model option never serves
+# responses from the old setup
+_EXTRACTION_SETUPS = {
+    "extract_prescription": (PRESCRIPTION_PROMPT, MAX_NEW_TOKENS_PRESCRIPTION),
+    "extract_lab_results": (LAB_RESULTS_PROMPT, MAX_NEW_TOKENS_LABS),
+}
+_EXTRACTION_FINGERPRINTS = {
+    method_name: hashlib.sha256(
+        f"{MODEL_ID}\n{SYSTEM_INSTRUCTION}\n{prompt}\n{max_new_tokens}".encode()
+    ).hexdigest()[:12]
+    for method_name, (prompt, max_new_tokens) in _EXTRACTION_SETUPS.items()
+}
+# Model options that change what MedGemma writes (read per call, like the backends)
+_OUTPUT_OPTION_ENV_VARS = (
+    QUANTIZATION_ENV_VAR,
+    SKIP_THINKING_ENV_VAR,
+    FLASH_ATTN_ENV_VAR,
+)
+# Enrichment output depends only on the extracted medications, so it is keyed
+# by their content: different photos of the same prescription share an entry
+_prescription_output_cache: LRUCache[tuple[str, int], "PrescriptionPipelineResult"] = (
+    LRUCache(EXTRACTION_CACHE_SIZE)
+)
+
+
+def _prescription_output_key(
+    extraction: PrescriptionExtraction, limit: int
+) -> tuple[str, int]:
+    # Field values come from the model and may be lists or dicts, so the key
+    # is their JSON form (always hashable) rather than the raw values
+    meds = [asdict(med) for med in extraction.medicamentos]
+    return json.dumps(meds, sort_keys=True, default=str), limit
+
+
+def _read_image(image_path: str) -> tuple[str | bytes, str | None]:
+    """Read the upload once, returning (image bytes, SHA-256 digest).
+
+    The original bytes are hashed for the caches. If the file cannot be read,
+    the path is returned with no digest and the backend reports the error.
+    """
+    try:
+        image_bytes = Path(image_path).read_bytes()
+    except OSError as exc:
+        logger.debug("Could not read image %s: %s", image_path, exc)
+        return image_path, None
+    return image_bytes, hashlib.sha256(image_bytes).hexdigest()
+
+
+# Pipelines pull in the CUM/SISMED API clients, so they are imported on the
+# first analysis instead of at app start-up
+
+
+def build_prescription_output(
+    extraction: PrescriptionExtraction, limit: int = 5
+) -> "PrescriptionPipelineResult":
+    from src.pipelines import build_prescription_output as _build
+
+    return _build(extraction, limit=limit)
+
+
+def format_medications_markdown(extraction: PrescriptionExtraction) -> str:
+    from src.pipelines.prescription_pipeline import format_medications_markdown as _format
+
+    return _format(extraction.medicamentos)
 
 
-def _resolve_backend_order() -> list[str]:
+def build_lab_results_output(extraction: LabResultExtraction) -> str:
+    from src.pipelines import build_lab_results_output as _build
+
+    return _build(extraction)
+
+
+def _resolve_backend_order() -> tuple[str, ...]:
     """Resolve backend order from INFERENCE_BACKEND env var."""
-    configured = os.environ.get(BACKEND_ENV_VAR, DEFAULT_BACKEND_MODE).strip().lower()
+    return _backend_order_for(os.environ.get(BACKEND_ENV_VAR, DEFAULT_BACKEND_MODE))
+
+
+@functools.lru_cache(maxsize=8)
+def _backend_order_for(setting: str) -> tuple[str, ...]:
+    """Backend order for a raw env value, parsed (and warned about) once."""
+    configured = setting.strip().lower()
     if configured == "auto":
-        return ["modal", "transformers"]
+        return ("modal", "transformers")
 
     if configured in SUPPORTED_BACKENDS:
-        return [configured]
+        return (configured,)
 
     logger.warning(
         "Invalid %s=%r. Supported values: auto, modal, transformers. Falling back to auto.",
         BACKEND_ENV_VAR,
         configured,
     )
-    return ["modal", "transformers"]
+    return ("modal", "transformers")
 
 
 def _get_backend_instance(backend_name: str) -> Any:
     """Get backend instance by name, lazily initialized and cached."""
-    backend = _backend_cache.get(backend_name)
-    if backend is None:
-        logger.info("Initializing inference backend: %s", backend_name)
-        backend = get_backend(backend_name)
-        _backend_cache[backend_name] = backend
+    with _backend_cache_lock:
+        backend = _backend_cache.get(backend_name)
+        if backend is None:
+            logger.info("Initializing inference backend: %s", backend_name)
+            backend = get_backend(backend_name)
+            _backend_cache[backend_name] = backend
     return backend
 
 
+def _backend_available(backend_name: str) -> bool:
+    retry_at = _backend_failures.get(backend_name, (0, 0.0))[1]
+    return time.monotonic() >= retry_at
+
+
+def _record_backend_failure(backend_name: str) -> None:
+    with _backend_cache_lock:
+        failures = _backend_failures.get(backend_name, (0, 0.0))[0] + 1
+        retry_at = 0.0
+        if failures >= BACKEND_FAILURE_THRESHOLD:
+            cooldown = min(BACKEND_MAX_COOLDOWN_SECONDS, 2.0**failures)
+            retry_at = time.monotonic() + cooldown
+            logger.warning(
+                "Backend %s failed %d times in a row; skipping it for %.0fs",
+                backend_name,
+                failures,
+                cooldown,
+            )
+        _backend_failures[backend_name] = (failures, retry_at)
+
+
+def _record_backend_success(backend_name: str) -> None:
+    if backend_name in _backend_failures:
+        with _backend_cache_lock:
+            _backend_failures.pop(backend_name, None)
+
+
+_warmup_started = threading.Event()
+
+
+def _warmup_backend() -> None:
+    """Warm up the first backend in the configured order that comes up."""
+    for backend_name in _resolve_backend_order():
+        try:
+            backend = _get_backend_instance(backend_name)
+            with log_timing(logger, f"warmup.{backend_name}"):
+                backend.warmup()
+            logger.info("Backend warm-up finished: %s", backend_name)
+            return
+        except Exception as exc:
+            logger.warning("Backend warm-up failed for %s: %s", backend_name, exc)
+
+
+def start_backend_warmup() -> None:
+    """Warm up the inference backend in the background, once per process.
+
+    Runs on page load so the model is ready by the time the user has picked
+    a photo, instead of the first "Analizar" click paying the cold start.
+    """
+    if _warmup_started.is_set():
+        return
+    _warmup_started.set()
+    threading.Thread(target=_warmup_backend, name="backend-warmup", daemon=True).start()
+
+
+def _get_disk_cache() -> DiskTextCache | None:
+    directory = os.environ.get(EXTRACTION_CACHE_DIR_ENV_VAR, "").strip()
+    if not directory:
+        return None
+    return DiskTextCache(
+        Path(directory).expanduser(),
+        max_entries=EXTRACTION_DISK_CACHE_MAX_ENTRIES,
+        max_age_s=EXTRACTION_DISK_CACHE_MAX_AGE_SECONDS,
+    )
+
+
+def _disk_cache_key(method_name: str, image_digest: str) -> str:
+    options = "\n".join(
+        os.environ.get(name, "").strip().lower() for name in _OUTPUT_OPTION_ENV_VARS
+    )
+    options_fingerprint = hashlib.sha256(options.encode()).hexdigest()[:8]
+    setup_fingerprint = _EXTRACTION_FINGERPRINTS[method_name]
+    return f"{method_name}-{setup_fingerprint}-{options_fingerprint}-{image_digest}"
+
+
+def _load_cached_extraction(
+    method_name: str, image_digest: str, is_valid_result: Callable[[Any], bool]
+) -> Any | None:
+    """Re-parse a raw response saved on disk by a previous run, if any."""
+    disk_cache = _get_disk_cache()
+    parse = _RESPONSE_PARSERS.get(method_name)
+    if disk_cache is None or parse is None:
+        return None
+    raw = disk_cache.get(_disk_cache_key(method_name, image_digest))
+    if raw is None:
+        return None
+    result = parse(raw)
+    return result if is_valid_result(result) else None
+
+
+def _save_cached_extraction(method_name: str, image_digest: str, result: Any) -> None:
+    disk_cache = _get_disk_cache()
+    raw = getattr(result, "raw_response", "")
+    if disk_cache is None or not raw or method_name not in _RESPONSE_PARSERS:
+        return
+    try:
+        disk_cache.put(_disk_cache_key(method_name, image_digest), raw)
+    except OSError as exc:
+        logger.warning("Could not write extraction cache entry: %s", exc)
+
+
 def _run_extraction_with_fallback(
-    image_path: str,
+    image: str | bytes,
     task_label: str,
     method_name: str,
     is_valid_result: Callable[[Any], bool],
+    image_digest: str | None = None,
 ) -> Any:
-    """Run extraction using configured backend order with graceful fallback."""
+    """Run extraction using configured backend order with graceful fallback.
+
+    Valid results are cached by (method_name, image_digest) when a digest is
+    given, so repeated uploads of the same image skip inference. With
+    EXTRACTION_CACHE_DIR set, the raw responses are also kept on disk.
+    Image bytes are downscaled only on a cache miss, so hits never decode
+    the photo.
+    """
+    cache_key = (method_name, image_digest) if image_digest else None
+    if cache_key:
+        cached = _extraction_cache.get(cache_key)
+        if cached is None:
+            cached = _load_cached_extraction(method_name, image_digest, is_valid_result)
+            if cached is not None:
+                _extraction_cache.put(cache_key, cached)
+        if cached is not None:
+            logger.info("%s extraction cache hit", task_label)
+            return cached
+
+    if isinstance(image, bytes):
+        # Large photos are shrunk so the backend gets a smaller upload
+        image = downscale_image_bytes(image)
+
     backend_order = _resolve_backend_order()
     errors: list[str] = []
 
+    # Backends in cooldown are skipped; if all are, try them anyway
+    available = [name for name in backend_order if _backend_available(name)]
     for backend_name in backend_order:
+        if available and backend_name not in available:
+            logger.info("Skipping backend=%s for %s (recent failures)", backend_name, task_label)
+            errors.append(f"{backend_name}: omitido por fallos recientes")
+            continue
         try:
             backend = _get_backend_instance(backend_name)
             logger.info("Trying backend=%s for %s", backend_name, task_label)
 
             with log_timing(logger, f"{task_label}.extract.{backend_name}"):
-                result = getattr(backend, method_name)(image_path)
+                result = getattr(backend, method_name)(image)
 
+            _record_backend_success(backend_name)
             if is_valid_result(result):
                 logger.info("%s extraction succeeded with backend=%s", task_label, backend_name)
+                if cache_key:
+                    _extraction_cache.put(cache_key, result)
+                    _save_cached_extraction(method_name, image_digest, result)
                 return result
 
             parse_success = getattr(result, "parse_success", False)
@@ -90,6 +354,7 @@ def _run_extraction_with_fallback(
             logger.exception(
                 "%s extraction failed with backend=%s: %s", task_label, backend_name, exc
             )
+            _record_backend_failure(backend_name)
             errors.append(f"{backend_name}: {exc}")
 
     attempted = ", ".join(backend_order)
@@ -109,30 +374,65 @@ de la salud antes de tomar decisiones sobre sus medicamentos.
 *No es consejo médico.*
 """
 
+HEADER_MD = """
+# MiSalud Entendida
+
+### Entiende tus recetas y exámenes con IA médica abierta
+"""
+
+FOOTER_MD = """
+---
+**MiSalud Entendida** - Desarrollado para el MedGemma Impact Challenge
+
+Usando [MedGemma 1.5](https://huggingface.co/google/medgemma-1.5-4b-it) para análisis de documentos médicos.
+Datos de medicamentos: [CUM](https://www.datos.gov.co/Salud-y-Protecci-n-Social/C-digo-nico-de-Medicamentos/i7cb-raxc) |
+[SISMED](https://www.datos.gov.co/Salud-y-Protecci-n-Social/SISMED/3he6-m866)
+"""
+
 
 # --- Prescription Tab Functions ---
 
 
-def analyze_prescription(image_path: str | None) -> tuple[str, str, str, str]:
-    """Analyze a prescription image and return formatted results.
+PENDING_EXTRACTION_MD = "⏳ Leyendo los medicamentos de su receta..."
+PENDING_GENERICS_MD = "⏳ Buscando alternativas genéricas..."
+PENDING_PRICES_MD = "⏳ Consultando precios de referencia..."
+PENDING_EXPLANATIONS_MD = "⏳ Preparando explicaciones..."
+
+
+async def analyze_prescription(
+    image_path: str | None,
+) -> AsyncIterator[tuple[str, str, str, str]]:
+    """Analyze a prescription image, streaming results as they become ready.
+
+    A progress message is shown immediately, the medications as soon as
+    MedGemma extraction finishes, and the generics, prices and explanations
+    once the CUM/SISMED lookups are done. Blocking work runs in worker
+    threads so the event loop keeps serving other sessions.
 
     Args:
         image_path: Path to the prescription image
 
-    Returns:
+    Yields:
         Tuple of (medications_md, generics_md, prices_md, explanations_md)
     """
-    logger.info("Analyze prescription button clicked")
+    logger.debug("Analyze prescription button clicked")
     if not image_path:
-        return "Por favor suba una imagen de su receta.", "", "", ""
+        yield "Por favor suba una imagen de su receta.", "", "", ""
+        return
+
+    # Acknowledge the click right away; extraction takes seconds
+    yield PENDING_EXTRACTION_MD, "", "", ""
 
     try:
         logger.info("Starting prescription analysis: %s", image_path)
-        result: PrescriptionExtraction = _run_extraction_with_fallback(
-            image_path=image_path,
+        image, image_digest = await asyncio.to_thread(_read_image, image_path)
+        result: PrescriptionExtraction = await asyncio.to_thread(
+            _run_extraction_with_fallback,
+            image=image,
             task_label="prescription",
             method_name="extract_prescription",
             is_valid_result=lambda r: r.parse_success and bool(r.medicamentos),
+            image_digest=image_digest,
         )
 
         if not result.parse_success or not result.medicamentos:
@@ -140,20 +440,37 @@ def analyze_prescription(image_path: str | None) -> tuple[str, str, str, str]:
                 "Prescription extraction returned no medications (parse_success=%s)",
                 result.parse_success,
             )
-            return (
+            yield (
                 "No se pudieron extraer medicamentos de esta imagen. "
                 "Asegúrese de que la imagen sea clara y legible.",
                 "",
                 "",
                 "",
             )
-
-        logger.info("Building prescription pipeline output")
-        with log_timing(logger, "prescription.build_output"):
-            pipeline_output = build_prescription_output(result, limit=5)
+            return
+
+        output_key = _prescription_output_key(result, limit=5)
+        pipeline_output = _prescription_output_cache.get(output_key)
+        if pipeline_output is None:
+            yield (
+                format_medications_markdown(result),
+                PENDING_GENERICS_MD,
+                PENDING_PRICES_MD,
+                PENDING_EXPLANATIONS_MD,
+            )
+            logger.info("Building prescription pipeline output")
+            with log_timing(logger, "prescription.build_output"):
+                pipeline_output = await asyncio.to_thread(
+                    build_prescription_output, result, limit=5
+                )
+            # Don't pin outputs degraded by transient CUM/SISMED failures
+            if not any(e.warnings for e in pipeline_output.enriched):
+                _prescription_output_cache.put(output_key, pipeline_output)
+        else:
+            logger.info("Prescription pipeline output cache hit")
 
         logger.info("Prescription analysis complete")
-        return (
+        yield (
             pipeline_output.medications_markdown,
             pipeline_output.generics_markdown,
             pipeline_output.prices_markdown,
@@ -162,32 +479,85 @@ def analyze_prescription(image_path: str | None) -> tuple[str, str, str, str]:
 
     except Exception as e:
         logger.exception("Prescription analysis failed: %s", e)
-        return f"Error al analizar la receta: {str(e)}", "", "", ""
+        yield f"Error al analizar la receta: {str(e)}", "", "", ""
+
+
+def skip_unchanged(
+    outputs: tuple[str, ...], previous: tuple[str, ...] | None
+) -> tuple[Any, ...]:
+    """Replace outputs equal to the previously rendered ones with gr.skip()."""
+    if previous is None:
+        return outputs
+    return tuple(
+        gr.skip() if output == last else output
+        for output, last in zip(outputs, previous)
+    )
+
+
+async def analyze_prescription_for_session(
+    image_path: str | None, last_rendered: tuple[str, str, str, str] | None
+) -> AsyncIterator[tuple[Any, ...]]:
+    """UI wrapper around analyze_prescription that skips unchanged panels.
+
+    Re-analyzing a similar prescription often yields identical generics or
+    prices, and streamed updates repeat the medications panel; those panels
+    are not re-sent or re-rendered.
+
+    Yields:
+        The four panel updates followed by the new rendered state
+    """
+    async for outputs in analyze_prescription(image_path):
+        yield (*skip_unchanged(outputs, last_rendered), outputs)
+        last_rendered = outputs
+
+
+async def _final_update(updates: AsyncIterator[Any]) -> Any:
+    """Drain a streaming handler and return its last update."""
+    final: Any = None
+    async for final in updates:
+        pass
+    return final
 
 
 # --- Lab Results Tab Functions ---
 
 
-def analyze_lab_results(image_path: str | None) -> str:
-    """Analyze a lab results image and return formatted results.
+PENDING_LAB_MD = "⏳ Leyendo los resultados de su examen..."
+
+
+async def analyze_lab_results(image_path: str | None) -> AsyncIterator[str]:
+    """Analyze a lab results image and stream formatted results.
+
+    A progress message is shown right away; lab extraction generates long
+    outputs, so this replaces several seconds of an empty panel. Extraction
+    runs in a worker thread so the event loop is not blocked.
 
     Args:
         image_path: Path to the lab results image
 
-    Returns:
-        Formatted markdown string with lab results
+    Yields:
+        A progress message, then the formatted markdown with lab results
     """
-    logger.info("Analyze lab results button clicked")
+    logger.debug("Analyze lab results button clicked")
     if not image_path:
-        return "Por favor suba una imagen de sus resultados de laboratorio."
+        yield "Por favor suba una imagen de sus resultados de laboratorio."
+        return
+
+    yield PENDING_LAB_MD
+    yield await _lab_results_markdown(image_path)
+
 
+async def _lab_results_markdown(image_path: str) -> str:
     try:
         logger.info("Starting lab results analysis: %s", image_path)
-        result: LabResultExtraction = _run_extraction_with_fallback(
-            image_path=image_path,
+        image, image_digest = await asyncio.to_thread(_read_image, image_path)
+        result: LabResultExtraction = await asyncio.to_thread(
+            _run_extraction_with_fallback,
+            image=image,
             task_label="lab",
             method_name="extract_lab_results",
             is_valid_result=lambda r: r.parse_success and bool(r.resultados),
+            image_digest=image_digest,
         )
 
         if not result.parse_success or not result.resultados:
@@ -211,125 +581,268 @@ def analyze_lab_results(image_path: str | None) -> str:
         return f"Error al analizar los resultados: {str(e)}"
 
 
+async def analyze_all(
+    prescription_path: str | None,
+    lab_path: str | None,
+    last_rendered: tuple[str, str, str, str] | None,
+) -> tuple[Any, ...]:
+    """Analyze the prescription and lab images concurrently ("Analizar Todo").
+
+    Both extractions run in worker threads, so the total wait is the slower
+    of the two instead of their sum. If only one image was uploaded, the
+    other tab is left untouched.
+
+    Returns:
+        The prescription panel updates and rendered state, then the lab output
+    """
+    analyze_rx = bool(prescription_path) or not lab_path
+    analyze_lab = bool(lab_path) or not prescription_path
+
+    async def prescription_updates() -> tuple[Any, ...]:
+        if not analyze_rx:
+            return (gr.skip(),) * 5
+        # Only the final result is sent here, so compare it with what is on screen
+        outputs = await _final_update(analyze_prescription(prescription_path))
+        return (*skip_unchanged(outputs, last_rendered), outputs)
+
+    async def lab_update() -> Any:
+        if not analyze_lab:
+            return gr.skip()
+        return await _final_update(analyze_lab_results(lab_path))
+
+    prescription_outputs, lab_output = await asyncio.gather(
+        prescription_updates(), lab_update()
+    )
+    return (*prescription_outputs, lab_output)
+
+
 # --- Medication Tracker Functions ---
 
 
-def get_tracker_displays(medications: list[str]) -> tuple[str, str]:
-    """Compute the medication list and interaction displays."""
-    meds_display = format_tracked_medications(medications)
-    interactions = check_interactions(medications)
-    interactions_display = format_interactions(interactions)
-    return meds_display, interactions_display
+EMPTY_MEDS_MD = (
+    "No hay medicamentos registrados. Agregue medicamentos usando el campo de arriba."
+)
+EMPTY_INTERACTIONS_MD = (
+    "✅ No se detectaron interacciones conocidas entre sus medicamentos."
+)
+TRACKER_CACHE_SIZE = 256
+# Idle time before the interaction panel is re-rendered after a change
+INTERACTIONS_DEBOUNCE_SECONDS = 0.15
 
 
-def format_tracked_medications(medications: list[str]) -> str:
-    """Format the list of tracked medications."""
+@dataclass(frozen=True)
+class TrackedMedications:
+    """Session state for the medication tracker.
+
+    Keeps the names in entry order for display, plus a set of folded names
+    so the case-insensitive duplicate check is a hash lookup.
+    """
+
+    names: tuple[str, ...] = ()
+    folded: frozenset[str] = frozenset()
+
+    @staticmethod
+    def fold(name: str) -> str:
+        """Comparison key: NFC-normalized and casefolded, so accents typed
+        as one or two code points and any letter case compare equal.
+        """
+        return unicodedata.normalize("NFC", name).casefold()
+
+    def __contains__(self, name: object) -> bool:
+        return isinstance(name, str) and self.fold(name) in self.folded
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.names)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def add(self, name: str) -> "TrackedMedications":
+        return TrackedMedications(self.names + (name,), self.folded | {self.fold(name)})
+
+    def remove(self, name: str) -> "TrackedMedications":
+        if name not in self.names:
+            return self
+        return TrackedMedications(
+            tuple(m for m in self.names if m != name),
+            self.folded - {self.fold(name)},
+        )
+
+
+def get_tracker_displays(medications: Sequence[str]) -> tuple[str, str]:
+    """Compute the medication list and interaction displays."""
     if not medications:
-        return "No hay medicamentos registrados. Agregue medicamentos usando el campo de arriba."
+        return EMPTY_MEDS_MD, EMPTY_INTERACTIONS_MD
+    if len(medications) < 2:
+        # No pairs to check with a single medication
+        return format_tracked_medications(medications), EMPTY_INTERACTIONS_MD
+    return _get_tracker_displays_cached(tuple(medications))
+
+
+@functools.lru_cache(maxsize=TRACKER_CACHE_SIZE)
+def _get_tracker_displays_cached(medications: tuple[str, ...]) -> tuple[str, str]:
+    """Memoized displays keyed on the exact (ordered, as-typed) medication list."""
+    meds = list(medications)
+    meds_display = format_tracked_medications(meds)
+    interactions = order_interactions(
+        _check_interactions_cached(frozenset(meds)), meds
+    )
+    interactions_display = format_interactions(interactions)
+    return meds_display, interactions_display
 
-    md = "## Mis Medicamentos\n\n"
-    for i, med in enumerate(medications, 1):
-        md += f"{i}. {med}\n"
-    return md
 
+@functools.lru_cache(maxsize=TRACKER_CACHE_SIZE)
+def _check_interactions_cached(medications: frozenset[str]) -> tuple[Interaction, ...]:
+    """Interactions for a set of medications, shared by every entry order.
 
-def format_interactions(interactions: list[Interaction]) -> str:
-    """Format interaction warnings as markdown."""
-    if not interactions:
-        return "✅ No se detectaron interacciones conocidas entre sus medicamentos."
+    Removing a drug and adding it back reorders the list but hits this cache.
+    """
+    return tuple(check_interactions(sorted(medications)))
 
-    md = "## ⚠️ Interacciones Detectadas\n\n"
 
-    for interaction in interactions:
-        severity_badge = {
-            "alta": "🔴 **ALTA**",
-            "media": "🟡 **MEDIA**",
-            "baja": "🟢 **BAJA**",
-        }.get(interaction.severity, "⚪")
+_SEVERITY_BADGES = {
+    "alta": "🔴 **ALTA**",
+    "media": "🟡 **MEDIA**",
+    "baja": "🟢 **BAJA**",
+}
+_INTERACTION_TEMPLATE = (
+    "### {drug_a} + {drug_b}\n\n**Severidad:** {badge}\n\n{warning}\n\n---\n"
+)
 
-        md += f"""### {interaction.drugs[0]} + {interaction.drugs[1]}
 
-**Severidad:** {severity_badge}
+def format_tracked_medications(medications: Sequence[str]) -> str:
+    """Format the list of tracked medications."""
+    if not medications:
+        return EMPTY_MEDS_MD
 
-{interaction.warning}
+    parts = ["## Mis Medicamentos\n\n"]
+    parts.extend(f"{i}. {med}\n" for i, med in enumerate(medications, 1))
+    return "".join(parts)
 
----
-"""
 
-    return md
+def format_interactions(interactions: list[Interaction]) -> str:
+    """Format interaction warnings as markdown."""
+    if not interactions:
+        return EMPTY_INTERACTIONS_MD
+
+    parts = ["## ⚠️ Interacciones Detectadas\n\n"]
+    parts.extend(
+        _INTERACTION_TEMPLATE.format(
+            drug_a=interaction.drugs[0],
+            drug_b=interaction.drugs[1],
+            badge=_SEVERITY_BADGES.get(interaction.severity, "⚪"),
+            warning=interaction.warning,
+        )
+        for interaction in interactions
+    )
+    return "".join(parts)
 
 
-def add_medication(
-    new_med: str, current_meds: list[str]
-) -> tuple[list[str], str, str, str]:
+async def add_medication(
+    new_med: str, current_meds: TrackedMedications
+) -> tuple[TrackedMedications, Any, str, Any]:
     """Add a medication to the tracker.
 
+    Only the cheap list display is rendered here; the interaction panel is
+    refreshed by refresh_interactions once the tracked state settles. The
+    remove dropdown is refreshed in the same response so the UI does not need
+    a second round-trip after each add. Tracker handlers are async so they run
+    on the event loop instead of taking a worker thread from the pool the
+    analyze handlers use.
+
     Returns:
-        Tuple of (updated_meds, meds_display, interactions_display, input_cleared)
+        Tuple of (updated_meds, meds_display, input_cleared, updated_dropdown);
+        display and dropdown are gr.skip() when nothing changed
     """
-    if not new_med or not new_med.strip():
-        meds_display, interactions_display = get_tracker_displays(current_meds)
-        return current_meds, meds_display, interactions_display, ""
+    new_med = (new_med or "").strip()
+
+    # Nothing to add (empty or duplicate, case-insensitive): leave the
+    # displays as they are instead of re-rendering them
+    if not new_med or new_med in current_meds:
+        return current_meds, gr.skip(), "", gr.skip()
+
+    updated_meds = current_meds.add(new_med)
+    return (
+        updated_meds,
+        format_tracked_medications(updated_meds.names),
+        "",
+        update_remove_dropdown(updated_meds),
+    )
 
-    new_med = new_med.strip()
 
-    # Avoid duplicates (case-insensitive)
-    if new_med.lower() in [m.lower() for m in current_meds]:
-        meds_display, interactions_display = get_tracker_displays(current_meds)
-        return current_meds, meds_display, interactions_display, ""
+async def remove_medication(
+    med_to_remove: str, current_meds: TrackedMedications
+) -> tuple[TrackedMedications, Any, Any]:
+    """Remove a medication from the tracker.
 
-    updated_meds = current_meds + [new_med]
-    meds_display, interactions_display = get_tracker_displays(updated_meds)
-    return updated_meds, meds_display, interactions_display, ""
+    Returns:
+        Tuple of (updated_meds, meds_display, updated_dropdown); display and
+        dropdown are gr.skip() when nothing changed
+    """
+    if not med_to_remove or med_to_remove not in current_meds.names:
+        return current_meds, gr.skip(), gr.skip()
+
+    updated_meds = current_meds.remove(med_to_remove)
+    return (
+        updated_meds,
+        format_tracked_medications(updated_meds.names),
+        update_remove_dropdown(updated_meds),
+    )
 
 
-def remove_medication(
-    med_to_remove: str, current_meds: list[str]
-) -> tuple[list[str], str, str]:
-    """Remove a medication from the tracker.
+async def clear_medications(
+    current_meds: TrackedMedications,
+) -> tuple[TrackedMedications, Any, Any]:
+    """Clear all medications from the tracker.
 
     Returns:
-        Tuple of (updated_meds, meds_display, interactions_display)
+        Tuple of (empty_meds, meds_display, updated_dropdown); display and
+        dropdown are gr.skip() when the tracker is already empty
     """
-    if not med_to_remove:
-        meds_display, interactions_display = get_tracker_displays(current_meds)
-        return current_meds, meds_display, interactions_display
+    if not current_meds:
+        return current_meds, gr.skip(), gr.skip()
 
-    updated_meds = [m for m in current_meds if m != med_to_remove]
-    meds_display, interactions_display = get_tracker_displays(updated_meds)
-    return updated_meds, meds_display, interactions_display
+    return (
+        TrackedMedications(),
+        EMPTY_MEDS_MD,
+        gr.Dropdown(choices=[], value=None),
+    )
 
 
-def clear_medications() -> tuple[list[str], str, str, gr.Dropdown]:
-    """Clear all medications from the tracker.
+async def refresh_interactions(medications: TrackedMedications) -> str:
+    """Render the interaction panel after a short idle window.
 
-    Returns:
-        Tuple of (empty_meds, meds_display, interactions_display, updated_dropdown)
+    Runs on every tracked-state change with trigger_mode="always_last", so a
+    burst of quick adds collapses into one check for the final list.
     """
-    meds_display, interactions_display = get_tracker_displays([])
-    return [], meds_display, interactions_display, gr.Dropdown(choices=[], value=None)
+    await asyncio.sleep(INTERACTIONS_DEBOUNCE_SECONDS)
+    return get_tracker_displays(medications.names)[1]
 
 
-def update_remove_dropdown(medications: list[str]) -> gr.Dropdown:
+def update_remove_dropdown(medications: Sequence[str] | TrackedMedications) -> gr.Dropdown:
     """Update the remove dropdown with current medications."""
-    return gr.Dropdown(choices=medications, value=None)
+    return gr.Dropdown(choices=list(medications), value=None)
 
 
 # --- Build Gradio Interface ---
 
+# Inference events share one concurrency group sized to the micro-batcher, so
+# concurrent clicks can be batched together while GPU calls stay bounded.
+# Tracker events are cheap and get their own, wider group so they stay
+# responsive while extractions are queued.
+INFERENCE_CONCURRENCY_ID = "medgemma"
+TRACKER_CONCURRENCY_ID = "tracker"
+TRACKER_CONCURRENCY_LIMIT = 32
+DEFAULT_CONCURRENCY_LIMIT = 8
+QUEUE_MAX_SIZE = 64
+
 
 def create_app() -> gr.Blocks:
     """Create and return the Gradio app."""
 
     with gr.Blocks(title="MiSalud Entendida") as app:
         # Header
-        gr.Markdown(
-            """
-# MiSalud Entendida
-
-### Entiende tus recetas y exámenes con IA médica abierta
-"""
-        )
+        gr.Markdown(HEADER_MD)
 
         # Disclaimer
         gr.Markdown(DISCLAIMER)
@@ -376,15 +889,22 @@ def create_app() -> gr.Blocks:
                     label="Explicación en español",
                 )
 
+                # Last markdown sent to each panel, to skip unchanged ones
+                prescription_rendered = gr.State(None)
+
+                # Let concurrent clicks reach the backend micro-batcher together
                 analyze_prescription_btn.click(
-                    fn=analyze_prescription,
-                    inputs=[prescription_image],
+                    fn=analyze_prescription_for_session,
+                    inputs=[prescription_image, prescription_rendered],
                     outputs=[
                         prescription_meds,
                         prescription_generics,
                         prescription_prices,
                         prescription_explanations,
+                        prescription_rendered,
                     ],
+                    concurrency_limit=BATCH_MAX_SIZE,
+                    concurrency_id=INFERENCE_CONCURRENCY_ID,
                 )
 
             # --- Lab Results Tab ---
@@ -415,6 +935,8 @@ def create_app() -> gr.Blocks:
                     fn=analyze_lab_results,
                     inputs=[lab_image],
                     outputs=[lab_results_output],
+                    concurrency_limit=BATCH_MAX_SIZE,
+                    concurrency_id=INFERENCE_CONCURRENCY_ID,
                 )
 
             # --- Medication Tracker Tab ---
@@ -426,7 +948,7 @@ def create_app() -> gr.Blocks:
                 )
 
                 # Session state for medications
-                tracked_meds = gr.State([])
+                tracked_meds = gr.State(TrackedMedications())
 
                 with gr.Row():
                     with gr.Column(scale=2):
@@ -450,80 +972,89 @@ def create_app() -> gr.Blocks:
                 with gr.Row():
                     with gr.Column():
                         meds_display = gr.Markdown(
-                            format_tracked_medications([]),
+                            EMPTY_MEDS_MD,
                             label="Medicamentos Registrados",
                         )
                     with gr.Column():
                         interactions_display = gr.Markdown(
-                            format_interactions([]),
+                            EMPTY_INTERACTIONS_MD,
                             label="Interacciones",
                         )
 
                 # Wire up medication tracker events
-                add_med_btn.click(
+                # Button and Enter share one event; queued duplicates (e.g. Enter
+                # followed by a focused button click) collapse to the latest one
+                gr.on(
+                    triggers=[add_med_btn.click, new_med_input.submit],
                     fn=add_medication,
                     inputs=[new_med_input, tracked_meds],
                     outputs=[
                         tracked_meds,
                         meds_display,
-                        interactions_display,
-                        new_med_input,
-                    ],
-                ).then(
-                    fn=update_remove_dropdown,
-                    inputs=[tracked_meds],
-                    outputs=[remove_med_dropdown],
-                )
-
-                # Also trigger on Enter key
-                new_med_input.submit(
-                    fn=add_medication,
-                    inputs=[new_med_input, tracked_meds],
-                    outputs=[
-                        tracked_meds,
-                        meds_display,
-                        interactions_display,
                         new_med_input,
+                        remove_med_dropdown,
                     ],
-                ).then(
-                    fn=update_remove_dropdown,
-                    inputs=[tracked_meds],
-                    outputs=[remove_med_dropdown],
+                    trigger_mode="always_last",
+                    concurrency_limit=TRACKER_CONCURRENCY_LIMIT,
+                    concurrency_id=TRACKER_CONCURRENCY_ID,
+                    show_progress="hidden",
                 )
 
                 remove_med_btn.click(
                     fn=remove_medication,
                     inputs=[remove_med_dropdown, tracked_meds],
-                    outputs=[tracked_meds, meds_display, interactions_display],
-                ).then(
-                    fn=update_remove_dropdown,
-                    inputs=[tracked_meds],
-                    outputs=[remove_med_dropdown],
+                    outputs=[tracked_meds, meds_display, remove_med_dropdown],
+                    trigger_mode="always_last",
+                    concurrency_limit=TRACKER_CONCURRENCY_LIMIT,
+                    concurrency_id=TRACKER_CONCURRENCY_ID,
+                    show_progress="hidden",
                 )
 
                 clear_all_btn.click(
                     fn=clear_medications,
-                    inputs=[],
-                    outputs=[
-                        tracked_meds,
-                        meds_display,
-                        interactions_display,
-                        remove_med_dropdown,
-                    ],
+                    inputs=[tracked_meds],
+                    outputs=[tracked_meds, meds_display, remove_med_dropdown],
+                    concurrency_limit=TRACKER_CONCURRENCY_LIMIT,
+                    concurrency_id=TRACKER_CONCURRENCY_ID,
                 )
 
-        # Footer
-        gr.Markdown(
-            """
----
-**MiSalud Entendida** - Desarrollado para el MedGemma Impact Challenge
+                # The interaction check is the expensive part, so it follows
+                # state changes separately; rapid adds coalesce to the latest
+                tracked_meds.change(
+                    fn=refresh_interactions,
+                    inputs=[tracked_meds],
+                    outputs=[interactions_display],
+                    trigger_mode="always_last",
+                    concurrency_limit=TRACKER_CONCURRENCY_LIMIT,
+                    concurrency_id=TRACKER_CONCURRENCY_ID,
+                    show_progress="hidden",
+                )
 
-Usando [MedGemma 1.5](https://huggingface.co/google/medgemma-1.5-4b-it) para análisis de documentos médicos.
-Datos de medicamentos: [CUM](https://www.datos.gov.co/Salud-y-Protecci-n-Social/C-digo-nico-de-Medicamentos/i7cb-raxc) |
-[SISMED](https://www.datos.gov.co/Salud-y-Protecci-n-Social/SISMED/3he6-m866)
-"""
+        analyze_all_btn = gr.Button("Analizar Todo", variant="secondary")
+        analyze_all_btn.click(
+            fn=analyze_all,
+            inputs=[prescription_image, lab_image, prescription_rendered],
+            outputs=[
+                prescription_meds,
+                prescription_generics,
+                prescription_prices,
+                prescription_explanations,
+                prescription_rendered,
+                lab_results_output,
+            ],
+            concurrency_limit=BATCH_MAX_SIZE,
+            concurrency_id=INFERENCE_CONCURRENCY_ID,
         )
 
+        # Footer
+        gr.Markdown(FOOTER_MD)
+
+        app.load(fn=start_backend_warmup, show_progress="hidden")
+
+    app.queue(
+        max_size=QUEUE_MAX_SIZE,
+        default_concurrency_limit=DEFAULT_CONCURRENCY_LIMIT,
+    )
     return app
 
 
@@ -0,0 +1,115 @@
+"""Small in-process caches shared by the app and inference layers.
+
+Usage:
+    from src.cache import LRUCache
+
+    cache: LRUCache[str, str] = LRUCache(maxsize=128)
+    cache.put("key", "value")
+    cache.get("key")  # -> "value"
+"""
+
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Generic, Hashable, TypeVar
+
+KeyT = TypeVar("KeyT", bound=Hashable)
+ValueT = TypeVar("ValueT")
+
+
+class LRUCache(Generic[KeyT, ValueT]):
+    """Thread-safe least-recently-used cache with a fixed size."""
+
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self._data: OrderedDict[KeyT, ValueT] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: KeyT) -> ValueT | None:
+        """Return the cached value (marking it as recently used) or None."""
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key: KeyT, value: ValueT) -> None:
+        """Store a value, evicting the least recently used entry if full."""
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class DiskTextCache:
+    """Text values stored one file per key, so entries survive restarts.
+
+    Keys must be safe file names (e.g. hex digests). Writes are atomic, so
+    concurrent readers never see a partial entry. Entries older than
+    max_age_s are deleted when read, and each write prunes the oldest files
+    beyond max_entries.
+    """
+
+    def __init__(
+        self,
+        directory: str | Path,
+        max_entries: int | None = None,
+        max_age_s: float | None = None,
+    ):
+        self.directory = Path(directory)
+        self.max_entries = max_entries
+        self.max_age_s = max_age_s
+
+    def get(self, key: str) -> str | None:
+        path = self.directory / key
+        try:
+            if self.max_age_s is not None:
+                if time.time() - path.stat().st_mtime > self.max_age_s:
+                    path.unlink(missing_ok=True)
+                    return None
+            return path.read_text(encoding="utf-8")
+        except OSError:
+            return None
+
+    def put(self, key: str, value: str) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as tmp:
+                tmp.write(value)
+            os.replace(tmp_path, self.directory / key)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+        self._prune()
+
+    def _prune(self) -> None:
+        """Delete expired entries and the oldest ones beyond max_entries."""
+        if self.max_entries is None and self.max_age_s is None:
+            return
+        entries: list[tuple[float, Path]] = []
+        for path in self.directory.iterdir():
+            if path.name.startswith(".tmp-"):
+                continue
+            try:
+                entries.append((path.stat().st_mtime, path))
+            except OSError:
+                continue
+        entries.sort(reverse=True)  # newest first
+        now = time.time()
+        for index, (mtime, path) in enumerate(entries):
+            too_many = self.max_entries is not None and index >= self.max_entries
+            too_old = self.max_age_s is not None and now - mtime > self.max_age_s
+            if too_many or too_old:
+                path.unlink(missing_ok=True)
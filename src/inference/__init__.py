@@ -6,6 +6,8 @@ from .medgemma import (
     ModalBackend,
     TransformersBackend,
     get_backend,
+    parse_lab_results_response,
+    parse_prescription_response,
 )
 
 __all__ = [
@@ -16,4 +18,7 @@ __all__ = [
     "ModalBackend",
     "TransformersBackend",
     "get_backend",
+    # Parsing
+    "parse_prescription_response",
+    "parse_lab_results_response",
 ]
@@ -0,0 +1,118 @@
+"""Micro-batching for concurrent MedGemma extraction requests.
+
+Gradio runs synchronous event handlers on a worker thread pool, so when
+several users click "Analizar" at the same time their extractions reach
+the backend from different threads. MicroBatcher collects the requests
+that arrive within a short window (or until the batch is full) and hands
+them to a single batch function call, so the model runs one forward pass
+instead of one per image.
+"""
+
+import threading
+from concurrent.futures import Future
+from queue import Empty, Queue
+from time import monotonic
+from typing import Callable, Generic, TypeVar
+
+from src.logger import get_logger
+
+logger = get_logger(__name__)
+
+ItemT = TypeVar("ItemT")
+ResultT = TypeVar("ResultT")
+
+# Batch size cap and how long the first request waits for company
+BATCH_MAX_SIZE = 8
+BATCH_MAX_WAIT_S = 0.03
+
+
+class MicroBatcher(Generic[ItemT, ResultT]):
+    """Coalesce concurrent single-item calls into batched calls.
+
+    Example:
+        batcher = MicroBatcher(lambda paths: backend.extract_raw_batch(paths, prompt))
+        raw = batcher.submit("receta.jpg")  # blocks until its batch finishes
+    """
+
+    def __init__(
+        self,
+        batch_fn: Callable[[list[ItemT]], list[ResultT]],
+        max_batch_size: int = BATCH_MAX_SIZE,
+        max_wait_s: float = BATCH_MAX_WAIT_S,
+        name: str = "micro_batcher",
+    ):
+        self._batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_s = max_wait_s
+        self.name = name
+        self._queue: Queue[tuple[ItemT, Future]] = Queue()
+        self._worker: threading.Thread | None = None
+        self._worker_lock = threading.Lock()
+
+    def submit(self, item: ItemT) -> ResultT:
+        """Queue an item and block until its batch has been processed.
+
+        If a batch fails, its items are retried one at a time, so a bad
+        image only fails its own caller; that caller gets the exception.
+        """
+        future: Future = Future()
+        self._ensure_worker()
+        self._queue.put((item, future))
+        return future.result()
+
+    def _ensure_worker(self) -> None:
+        with self._worker_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(
+                    target=self._run, name=self.name, daemon=True
+                )
+                self._worker.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = monotonic() + self.max_wait_s
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except Empty:
+                    break
+            self._dispatch(batch)
+
+    def _call_batch_fn(self, items: list[ItemT]) -> list[ResultT]:
+        results = self._batch_fn(items)
+        if len(results) != len(items):
+            raise RuntimeError(
+                f"{self.name}: batch returned {len(results)} results "
+                f"for {len(items)} items"
+            )
+        return results
+
+    def _dispatch(self, batch: list[tuple[ItemT, Future]]) -> None:
+        items = [item for item, _ in batch]
+        logger.debug("%s dispatching batch of %d", self.name, len(items))
+        try:
+            results = self._call_batch_fn(items)
+        except Exception as exc:
+            if len(batch) == 1:
+                batch[0][1].set_exception(exc)
+                return
+            # One bad item (e.g. a corrupt upload) must not fail the others
+            logger.warning(
+                "%s batch of %d failed (%s); retrying items one by one",
+                self.name,
+                len(batch),
+                exc,
+            )
+            for item, future in batch:
+                try:
+                    future.set_result(self._call_batch_fn([item])[0])
+                except Exception as item_exc:
+                    future.set_exception(item_exc)
+            return
+
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
@@ -10,3 +10,35 @@ MODEL_ID = "google/medgemma-1.5-4b-it"
 MAX_NEW_TOKENS_PRESCRIPTION = 2048
 MAX_NEW_TOKENS_LABS = 6144
 MAX_NEW_TOKENS_DEFAULT = 2048
+
+# Uploads are downscaled to this longest edge before inference; phone photos
+# (often 3000x4000) only add transfer and preprocessing time past this size
+MAX_IMAGE_EDGE = 1568
+DOWNSCALE_JPEG_QUALITY = 90
+
+# A one-token generate on a tiny blank image runs once after the model loads,
+# so the first real request skips CUDA kernel selection and allocator warm-up
+WARMUP_IMAGE_EDGE = 32
+
+# Optional weight quantization for local and Modal loads (needs bitsandbytes).
+# bf16 keeps full precision; int8/int4 trade some accuracy for less VRAM and
+# faster memory-bound decoding, so check extraction quality before enabling
+QUANTIZATION_ENV_VAR = "MEDGEMMA_QUANT"
+QUANTIZATION_MODES = ("bf16", "int8", "int4")
+
+# Set MEDGEMMA_FLASH_ATTN=1 to load with FlashAttention-2 (needs flash-attn).
+# It changes attention numerics, including how Gemma 3 image tokens attend to
+# each other, so the default stays on PyTorch SDPA; validate quality first
+FLASH_ATTN_ENV_VAR = "MEDGEMMA_FLASH_ATTN"
+
+# Set MEDGEMMA_COMPILE=1 to use a static KV cache, which lets transformers
+# torch.compile the decoding step. The first generate per input shape pays the
+# compile time; warm-up pre-compiles single-image prescription and lab calls,
+# but batches still compile on first use, so this suits long-lived GPU workers
+COMPILE_ENV_VAR = "MEDGEMMA_COMPILE"
+
+# Set MEDGEMMA_SKIP_THINKING=1 to ban the token that opens MedGemma 1.5's
+# thinking segment, so generate() goes straight to the JSON answer. Saves the
+# decode steps spent on reasoning we discard; validate extraction quality first
+SKIP_THINKING_ENV_VAR = "MEDGEMMA_SKIP_THINKING"
+THINKING_START_TOKEN = "<unused94>"
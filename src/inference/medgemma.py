@@ -5,19 +5,34 @@ Supports multiple backends:
 - TransformersBackend: Local GPU inference (for Kaggle notebooks or local GPU)
 """
 
+import functools
+import logging
+import threading
 from abc import ABC, abstractmethod
-from pathlib import Path
 from typing import Literal
 
 from src.logger import get_logger, log_timing
 
 from src.inference.constants import (
+    MAX_IMAGE_EDGE,
     MAX_NEW_TOKENS_DEFAULT,
     MAX_NEW_TOKENS_LABS,
     MAX_NEW_TOKENS_PRESCRIPTION,
     MODEL_ID,
 )
-from src.inference.utils import extract_json_from_response
+from src.inference.batcher import MicroBatcher
+from src.inference.utils import (
+    ImageInput,
+    build_extraction_messages,
+    build_warmup_generations,
+    configure_generation,
+    describe_image,
+    downscale_image_bytes,
+    extract_json_from_response,
+    model_load_kwargs,
+    open_image,
+    read_image_bytes,
+)
 from src.models import (
     LabResultExtraction,
     PrescriptionExtraction,
@@ -25,37 +40,95 @@ from src.models import (
 from src.prompts import (
     LAB_RESULTS_PROMPT,
     PRESCRIPTION_PROMPT,
-    SYSTEM_INSTRUCTION,
 )
 
 logger = get_logger(__name__)
 
+# --- Response Parsing ---
+
+
+def parse_prescription_response(raw: str) -> PrescriptionExtraction:
+    """Parse a raw MedGemma prescription response into a PrescriptionExtraction."""
+    result = PrescriptionExtraction.from_json(extract_json_from_response(raw))
+    result.raw_response = raw
+    return result
+
+
+def parse_lab_results_response(raw: str) -> LabResultExtraction:
+    """Parse a raw MedGemma lab results response into a LabResultExtraction."""
+    result = LabResultExtraction.from_json(extract_json_from_response(raw))
+    result.raw_response = raw
+    return result
+
+
 # --- Backend Abstraction ---
 
 
 class MedGemmaBackend(ABC):
     """Abstract base class for MedGemma inference backends."""
 
+    def __init__(self):
+        self._batchers: dict[tuple[str, int], MicroBatcher] = {}
+        self._batchers_lock = threading.Lock()
+
     @abstractmethod
     def extract_raw(
         self,
-        image_path: str | Path,
+        image: ImageInput,
         prompt: str,
         max_new_tokens: int = MAX_NEW_TOKENS_DEFAULT,
     ) -> str:
         """Run raw extraction and return model response as string."""
         pass
 
-    def extract_prescription(self, image_path: str | Path) -> PrescriptionExtraction:
-        """Extract prescription data from an image."""
-        logger.info("Extracting prescription from %s", image_path)
-        raw = self.extract_raw(
-            image_path, PRESCRIPTION_PROMPT, max_new_tokens=MAX_NEW_TOKENS_PRESCRIPTION
+    def warmup(self) -> None:
+        """Pay cold-start costs (model load, container start) ahead of requests."""
+        pass
+
+    def extract_raw_batch(
+        self,
+        images: list[ImageInput],
+        prompt: str,
+        max_new_tokens: int = MAX_NEW_TOKENS_DEFAULT,
+    ) -> list[str]:
+        """Run raw extraction for several images with the same prompt.
+
+        The default runs one call per image; backends override this to run a
+        single batched forward pass.
+        """
+        return [
+            self.extract_raw(image, prompt, max_new_tokens=max_new_tokens)
+            for image in images
+        ]
+
+    def _extract_raw_batched(
+        self,
+        image: ImageInput,
+        prompt: str,
+        max_new_tokens: int,
+    ) -> str:
+        """Run extract_raw through a micro-batcher shared by concurrent callers."""
+        key = (prompt, max_new_tokens)
+        with self._batchers_lock:
+            batcher = self._batchers.get(key)
+            if batcher is None:
+                batcher = MicroBatcher(
+                    lambda images: self.extract_raw_batch(
+                        images, prompt, max_new_tokens=max_new_tokens
+                    ),
+                    name=f"{type(self).__name__}.batcher",
+                )
+                self._batchers[key] = batcher
+        return batcher.submit(image)
+
+    def extract_prescription(self, image: ImageInput) -> PrescriptionExtraction:
+        """Extract prescription data from an image path or image bytes."""
+        logger.info("Extracting prescription from %s", describe_image(image))
+        raw = self._extract_raw_batched(
+            image, PRESCRIPTION_PROMPT, max_new_tokens=MAX_NEW_TOKENS_PRESCRIPTION
         )
         logger.debug("Raw response (first 200 chars): %s", raw[:200] if raw else "empty")
-        extracted = extract_json_from_response(raw)
-        result = PrescriptionExtraction.from_json(extracted)
-        result.raw_response = raw
+        result = parse_prescription_response(raw)
         logger.info(
             "Prescription extraction complete: %d medications, parse_success=%s",
             len(result.medicamentos),
@@ -63,16 +136,14 @@ class MedGemmaBackend(ABC):
         )
         return result
 
-    def extract_lab_results(self, image_path: str | Path) -> LabResultExtraction:
-        """Extract lab results data from an image."""
-        logger.info("Extracting lab results from %s", image_path)
-        raw = self.extract_raw(
-            image_path, LAB_RESULTS_PROMPT, max_new_tokens=MAX_NEW_TOKENS_LABS
+    def extract_lab_results(self, image: ImageInput) -> LabResultExtraction:
+        """Extract lab results data from an image path or image bytes."""
+        logger.info("Extracting lab results from %s", describe_image(image))
+        raw = self._extract_raw_batched(
+            image, LAB_RESULTS_PROMPT, max_new_tokens=MAX_NEW_TOKENS_LABS
         )
         logger.debug("Raw response (first 200 chars): %s", raw[:200] if raw else "empty")
-        extracted = extract_json_from_response(raw)
-        result = LabResultExtraction.from_json(extracted)
-        result.raw_response = raw
+        result = parse_lab_results_response(raw)
         logger.info(
             "Lab results extraction complete: %d results, parse_success=%s",
             len(result.resultados),
@@ -84,29 +155,53 @@ class MedGemmaBackend(ABC):
 class ModalBackend(MedGemmaBackend):
     """Backend that calls Modal function for remote GPU inference."""
 
+    def __init__(self):
+        super().__init__()
+        self._remote_model = None
+
+    def _get_remote_model(self):
+        """Look up the deployed Modal class once and reuse the handle."""
+        if self._remote_model is not None:
+            return self._remote_model
+
+        import modal
+
+        from .modal_app import APP_NAME, CLS_NAME
+
+        with log_timing(logger, "modal.lookup_cls"):
+            Model = modal.Cls.from_name(APP_NAME, CLS_NAME)
+            self._remote_model = Model()
+        return self._remote_model
+
+    def warmup(self) -> None:
+        """Start a Modal container so the model is loaded before the first image."""
+        model = self._get_remote_model()
+        with log_timing(logger, "modal.ping.remote"):
+            model.ping.remote()
+
     def extract_raw(
         self,
-        image_path: str | Path,
+        image: ImageInput,
         prompt: str,
         max_new_tokens: int = MAX_NEW_TOKENS_DEFAULT,
     ) -> str:
         """Call deployed Modal function to extract from image."""
-        import modal
-
-        image_path = Path(image_path)
-        if not image_path.exists():
-            raise FileNotFoundError(f"Image not found: {image_path}")
+        # Oversized photos are shrunk before upload (a header check when already small)
+        image_bytes = downscale_image_bytes(read_image_bytes(image))
 
         width = height = None
-        try:
-            from PIL import Image
+        # Image dimensions are only used for the request log line
+        if logger.isEnabledFor(logging.INFO):
+            try:
+                import io
+
+                from PIL import Image
 
-            with Image.open(image_path) as img:
-                width, height = img.size
-        except Exception as exc:
-            logger.debug("Failed to read image dimensions: %s", exc)
+                with Image.open(io.BytesIO(image_bytes)) as img:
+                    width, height = img.size
+            except Exception as exc:
+                logger.debug("Failed to read image dimensions: %s", exc)
 
-        image_bytes = image_path.read_bytes()
         logger.debug("Image bytes size: %d", len(image_bytes))
         logger.info(
             "Submitting Modal request (bytes=%d, image=%sx%s, prompt_chars=%d, max_new_tokens=%d)",
@@ -116,10 +211,7 @@ class ModalBackend(MedGemmaBackend):
             len(prompt),
             max_new_tokens,
         )
-        from .modal_app import APP_NAME, CLS_NAME
-
-        Model = modal.Cls.from_name(APP_NAME, CLS_NAME)
-        model = Model()
+        model = self._get_remote_model()
         with log_timing(logger, "modal.extract_from_image.remote"):
             result = model.extract_from_image.remote(
                 image_bytes, prompt, max_new_tokens=max_new_tokens
@@ -128,6 +220,72 @@ class ModalBackend(MedGemmaBackend):
         logger.debug("Modal call complete, response length: %d", len(result) if result else 0)
         return result
 
+    def extract_raw_batch(
+        self,
+        images: list[ImageInput],
+        prompt: str,
+        max_new_tokens: int = MAX_NEW_TOKENS_DEFAULT,
+    ) -> list[str]:
+        """Send several images to Modal in one remote call."""
+        if len(images) == 1:
+            return [self.extract_raw(images[0], prompt, max_new_tokens=max_new_tokens)]
+
+        images_bytes = [downscale_image_bytes(read_image_bytes(image)) for image in images]
+
+        logger.info(
+            "Submitting Modal batch request (images=%d, total_bytes=%d, max_new_tokens=%d)",
+            len(images_bytes),
+            sum(len(b) for b in images_bytes),
+            max_new_tokens,
+        )
+        model = self._get_remote_model()
+        with log_timing(logger, "modal.extract_batch.remote"):
+            results = model.extract_batch.remote(
+                images_bytes, prompt, max_new_tokens=max_new_tokens
+            )
+        logger.info("Modal batch request finished")
+        return results
+
+
+# Serializes first loads so concurrent requests don't load the weights twice
+_local_model_lock = threading.Lock()
+# The model is shared and (with MEDGEMMA_COMPILE) keeps its static KV cache
+# between calls, so generate() calls from different batchers run one at a time
+_local_generate_lock = threading.Lock()
+
+
+def _load_local_model(model_id: str):
+    """Return (processor, model), loading the weights once per process."""
+    with _local_model_lock:
+        return _load_local_model_unlocked(model_id)
+
+
+@functools.lru_cache(maxsize=1)
+def _load_local_model_unlocked(model_id: str):
+    import os
+
+    from transformers import AutoModelForImageTextToText, AutoProcessor
+
+    hf_token = os.environ.get("HF_TOKEN")
+    if not hf_token:
+        raise ValueError("HF_TOKEN environment variable required for MedGemma access")
+
+    load_kwargs = model_load_kwargs()
+    logger.info("Loading MedGemma model: %s", model_id)
+    with log_timing(logger, "local.load_processor"):
+        processor = AutoProcessor.from_pretrained(
+            model_id, token=hf_token, use_fast=True
+        )
+    with log_timing(logger, "local.load_model"):
+        model = AutoModelForImageTextToText.from_pretrained(
+            model_id, token=hf_token, **load_kwargs
+        )
+    configure_generation(model, processor)
+    # Decoder-only generation needs left padding for batched prompts
+    processor.tokenizer.padding_side = "left"
+    logger.info("Model loaded successfully")
+    return processor, model
+
 
 class TransformersBackend(MedGemmaBackend):
     """Backend for direct local GPU inference using transformers.
@@ -137,97 +295,92 @@ class TransformersBackend(MedGemmaBackend):
     """
 
     def __init__(self, model_id: str = MODEL_ID):
+        super().__init__()
         self.model_id = model_id
         self._model = None
         self._processor = None
 
     def _load_model(self):
-        """Lazy load model and processor."""
+        """Lazy load model and processor (shared by every instance)."""
         if self._model is not None:
             return
+        self._processor, self._model = _load_local_model(self.model_id)
 
-        import os
+    def warmup(self) -> None:
+        """Load the model weights and run the warm-up generations ahead of use.
 
-        import torch
-        from transformers import AutoModelForImageTextToText, AutoProcessor
-
-        hf_token = os.environ.get("HF_TOKEN")
-        if not hf_token:
-            raise ValueError(
-                "HF_TOKEN environment variable required for MedGemma access"
-            )
-
-        logger.info("Loading MedGemma model: %s", self.model_id)
-        with log_timing(logger, "local.load_processor"):
-            self._processor = AutoProcessor.from_pretrained(
-                self.model_id, token=hf_token, use_fast=True
-            )
-        with log_timing(logger, "local.load_model"):
-            self._model = AutoModelForImageTextToText.from_pretrained(
-                self.model_id,
-                token=hf_token,
-                dtype=torch.bfloat16,  # Use dtype instead of deprecated torch_dtype
-                device_map="auto",
-            )
-        logger.info("Model loaded successfully")
+        A one-token call by default; with MEDGEMMA_COMPILE, the real
+        prescription and lab prompts at their full token budgets (see
+        build_warmup_generations).
+        """
+        self._load_model()
+        with log_timing(logger, "local.warmup_generate"):
+            for messages, max_new_tokens in build_warmup_generations():
+                self._generate_with_messages([messages], max_new_tokens)
 
-    def extract_raw(
+    def _generate_with_messages(
         self,
-        image_path: str | Path,
-        prompt: str,
-        max_new_tokens: int = MAX_NEW_TOKENS_DEFAULT,
-    ) -> str:
-        """Run local inference to extract from image."""
+        conversations: list[list[dict]],
+        max_new_tokens: int,
+    ) -> list[str]:
+        """Run one generate call over one or more chat conversations."""
         import torch
-        from PIL import Image
-
-        self._load_model()
-
-        image_path = Path(image_path)
-        if not image_path.exists():
-            raise FileNotFoundError(f"Image not found: {image_path}")
-
-        pil_image = Image.open(image_path).convert("RGB")
-
-        # Format conversation following official docs (system + user with text before image)
-        messages = [
-            {
-                "role": "system",
-                "content": [{"type": "text", "text": SYSTEM_INSTRUCTION}],
-            },
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": prompt},
-                    {"type": "image", "image": pil_image},
-                ],
-            },
-        ]
 
-        # Process input (cast to bfloat16 per official docs)
+        # Process input (cast to the model dtype, bfloat16 on GPU per official docs)
         inputs = self._processor.apply_chat_template(
-            messages,
+            conversations,
             add_generation_prompt=True,
             tokenize=True,
             return_dict=True,
             return_tensors="pt",
-        ).to(self._model.device, dtype=torch.bfloat16)
+            padding=True,
+        ).to(self._model.device, dtype=self._model.dtype)
 
         # Generate response
-        with torch.inference_mode():
+        with _local_generate_lock, torch.inference_mode():
             outputs = self._model.generate(
                 **inputs,
                 max_new_tokens=max_new_tokens,
                 do_sample=False,
             )
 
+        # Prompts are left-padded to a common length, so new tokens start here
         input_len = inputs["input_ids"].shape[-1]
-        response = self._processor.decode(
-            outputs[0][input_len:], skip_special_tokens=True
+        return self._processor.batch_decode(
+            outputs[:, input_len:], skip_special_tokens=True
         )
 
+    def extract_raw(
+        self,
+        image: ImageInput,
+        prompt: str,
+        max_new_tokens: int = MAX_NEW_TOKENS_DEFAULT,
+    ) -> str:
+        """Run local inference to extract from image."""
+        self._load_model()
+        pil_image = open_image(image, max_edge=MAX_IMAGE_EDGE)
+
         # Return raw response to allow local parsing/logging
-        return response
+        return self._generate_with_messages(
+            [build_extraction_messages(prompt, pil_image)], max_new_tokens
+        )[0]
+
+    def extract_raw_batch(
+        self,
+        images: list[ImageInput],
+        prompt: str,
+        max_new_tokens: int = MAX_NEW_TOKENS_DEFAULT,
+    ) -> list[str]:
+        """Run local inference for several images in one forward pass."""
+        self._load_model()
+        conversations = [
+            build_extraction_messages(
+                prompt, open_image(image, max_edge=MAX_IMAGE_EDGE)
+            )
+            for image in images
+        ]
+        with log_timing(logger, f"local.generate_batch[{len(conversations)}]"):
+            return self._generate_with_messages(conversations, max_new_tokens)
 
 
 # --- Factory ---
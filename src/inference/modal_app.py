@@ -1,22 +1,54 @@
 """Modal inference function for MedGemma on A10G GPU."""
 
+import logging
 import os
 from pathlib import Path
 
 import modal
 
 from src.inference.constants import (
+    COMPILE_ENV_VAR,
+    FLASH_ATTN_ENV_VAR,
+    MAX_IMAGE_EDGE,
     MAX_NEW_TOKENS_DEFAULT,
     MAX_NEW_TOKENS_PRESCRIPTION,
     MODEL_ID,
+    QUANTIZATION_ENV_VAR,
+    SKIP_THINKING_ENV_VAR,
+)
+from src.inference.utils import (
+    build_extraction_messages,
+    build_warmup_generations,
+    configure_generation,
+    model_load_kwargs,
+    open_image,
 )
 from src.logger import get_logger, log_timing
 
 APP_NAME = "misalud-medgemma"
 CLS_NAME = "MedGemmaModel"
 APP_PATH = Path("/root/app")
+# Model weights live in a persistent volume, so only the first container ever
+# downloads them; later cold starts read the cached safetensors from disk
+HF_CACHE_VOLUME_NAME = "misalud-hf-cache"
+HF_CACHE_PATH = Path("/root/.cache/huggingface")
+# With MEDGEMMA_COMPILE=1, Inductor's compiled kernels are kept in a volume
+# too, so new containers reuse them instead of recompiling on warm-up
+COMPILE_CACHE_VOLUME_NAME = "misalud-compile-cache"
+COMPILE_CACHE_PATH = Path("/root/.cache/torchinductor")
+
+# Installed only for MEDGEMMA_QUANT=int8/int4 deploys (outside uv.lock), so pinned
+BITSANDBYTES_VERSION = "0.50.2"
+
+# Containers kept running while idle; set MODAL_MIN_CONTAINERS=1 at deploy
+# time to keep the model loaded and skip cold starts (billed while idle)
+MIN_CONTAINERS = int(os.environ.get("MODAL_MIN_CONTAINERS", "0"))
 
 app = modal.App(APP_NAME)
+hf_cache_volume = modal.Volume.from_name(HF_CACHE_VOLUME_NAME, create_if_missing=True)
+compile_cache_volume = modal.Volume.from_name(
+    COMPILE_CACHE_VOLUME_NAME, create_if_missing=True
+)
 logger = get_logger(__name__)
 
 # Build image with uv for dependency management
@@ -27,9 +59,25 @@ image = (
     .add_local_file("pyproject.toml", str(APP_PATH / "pyproject.toml"), copy=True)
     .add_local_file("uv.lock", str(APP_PATH / "uv.lock"), copy=True)
     .add_local_dir("src", str(APP_PATH / "src"), copy=True)
-    .env({"UV_PROJECT_ENVIRONMENT": "/usr/local"})
+    .env(
+        {
+            "UV_PROJECT_ENVIRONMENT": "/usr/local",
+            "HF_HOME": str(HF_CACHE_PATH),
+            "TORCHINDUCTOR_CACHE_DIR": str(COMPILE_CACHE_PATH),
+            "TORCHINDUCTOR_FX_GRAPH_CACHE": "1",
+            # Model options chosen at deploy time (MEDGEMMA_QUANT=int8 modal deploy ...)
+            QUANTIZATION_ENV_VAR: os.environ.get(QUANTIZATION_ENV_VAR, "bf16"),
+            COMPILE_ENV_VAR: os.environ.get(COMPILE_ENV_VAR, ""),
+            FLASH_ATTN_ENV_VAR: os.environ.get(FLASH_ATTN_ENV_VAR, ""),
+            SKIP_THINKING_ENV_VAR: os.environ.get(SKIP_THINKING_ENV_VAR, ""),
+        }
+    )
     .run_commands("uv sync --frozen --compile-bytecode --python-preference=only-system")
 )
+if os.environ.get(QUANTIZATION_ENV_VAR, "bf16").strip().lower() != "bf16":
+    # Quantized loads need bitsandbytes, which is not in the locked dependencies,
+    # so it is pinned here to keep quantized deploys reproducible
+    image = image.pip_install(f"bitsandbytes=={BITSANDBYTES_VERSION}")
 
 
 @app.cls(
@@ -37,7 +85,11 @@ image = (
     gpu="A10G",
     timeout=60 * 10,  # 10 minutes
     secrets=[modal.Secret.from_name("huggingface")],
-    min_containers=0,
+    volumes={
+        str(HF_CACHE_PATH): hf_cache_volume,
+        str(COMPILE_CACHE_PATH): compile_cache_volume,
+    },
+    min_containers=MIN_CONTAINERS,
     scaledown_window=300,
 )
 class MedGemmaModel:
@@ -45,7 +97,6 @@ class MedGemmaModel:
 
     @modal.enter()
     def setup(self):
-        import torch
         from transformers import AutoModelForImageTextToText, AutoProcessor
 
         hf_token = os.environ.get("HF_TOKEN")
@@ -54,6 +105,7 @@ class MedGemmaModel:
                 "HF_TOKEN environment variable required for MedGemma access. "
                 "Add the 'huggingface' secret to your Modal app and redeploy."
             )
+        load_kwargs = model_load_kwargs()
         logger.info("Loading MedGemma model in Modal: %s", MODEL_ID)
         with log_timing(logger, "modal.setup.load_processor"):
             self.processor = AutoProcessor.from_pretrained(
@@ -61,13 +113,71 @@ class MedGemmaModel:
             )
         with log_timing(logger, "modal.setup.load_model"):
             self.model = AutoModelForImageTextToText.from_pretrained(
-                MODEL_ID,
-                token=hf_token,
-                dtype=torch.bfloat16,  # Use dtype instead of deprecated torch_dtype
-                device_map="auto",
+                MODEL_ID, token=hf_token, **load_kwargs
             )
+        configure_generation(self.model, self.processor)
+        # Decoder-only generation needs left padding for batched prompts
+        self.processor.tokenizer.padding_side = "left"
+        with log_timing(logger, "modal.setup.warmup_generate"):
+            for messages, max_new_tokens in build_warmup_generations():
+                self._generate_with_messages([messages], max_new_tokens)
+        # Persist a fresh download and any compiled kernels for the next cold
+        # container (no-op when nothing changed)
+        hf_cache_volume.commit()
+        compile_cache_volume.commit()
         logger.info("Modal model ready")
 
+    def _decode_image(self, image_bytes: bytes):
+        # The app uploads downscaled images; this also caps direct callers
+        return open_image(image_bytes, max_edge=MAX_IMAGE_EDGE)
+
+    def _generate_with_messages(
+        self,
+        conversations: list[list[dict]],
+        max_new_tokens: int,
+    ) -> list[str]:
+        """Run one generate call over one or more chat conversations."""
+        import torch
+
+        # Process input (cast to the model dtype, bfloat16 on GPU per official docs)
+        with log_timing(logger, "modal.extract.apply_chat_template"):
+            inputs = self.processor.apply_chat_template(
+                conversations,
+                add_generation_prompt=True,
+                tokenize=True,
+                return_dict=True,
+                return_tensors="pt",
+                padding=True,
+            ).to(self.model.device, dtype=self.model.dtype)
+
+        # Generate response
+        with torch.inference_mode():
+            with log_timing(logger, "modal.extract.generate"):
+                outputs = self.model.generate(
+                    **inputs,
+                    max_new_tokens=max_new_tokens,
+                    do_sample=False,
+                )
+
+        # Decode response (skip input tokens; prompts are left-padded to one length)
+        input_len = inputs["input_ids"].shape[-1]
+        output_tokens = outputs.shape[-1] - input_len
+        logger.info(
+            "Modal tokens (batch=%d, input=%d, output=%d)",
+            len(conversations),
+            input_len,
+            max(output_tokens, 0),
+        )
+        with log_timing(logger, "modal.extract.decode_output"):
+            return self.processor.batch_decode(
+                outputs[:, input_len:], skip_special_tokens=True
+            )
+
+    @modal.method()
+    def ping(self) -> bool:
+        """No-op call that starts a container (and loads the model) ahead of use."""
+        return True
+
     @modal.method()
     def extract_from_image(
         self,
@@ -86,13 +196,6 @@ class MedGemmaModel:
         Returns:
             Model response (expected to be JSON string)
         """
-        import io
-
-        import torch
-        from PIL import Image
-
-        from src.prompts import SYSTEM_INSTRUCTION
-
         logger.info(
             "Modal extract_from_image start (bytes=%d, max_new_tokens=%d)",
             len(image_bytes),
@@ -101,7 +204,7 @@ class MedGemmaModel:
 
         # Load image from bytes
         with log_timing(logger, "modal.extract.decode_image"):
-            pil_image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+            pil_image = self._decode_image(image_bytes)
         width, height = pil_image.size
         logger.info(
             "Modal request context: image=%dx%d, prompt_chars=%d, max_new_tokens=%d",
@@ -112,55 +215,48 @@ class MedGemmaModel:
         )
 
         # Format conversation for MedGemma (following official docs structure)
-        messages = [
-            {
-                "role": "system",
-                "content": [{"type": "text", "text": SYSTEM_INSTRUCTION}],
-            },
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": prompt},
-                    {"type": "image", "image": pil_image},
-                ],
-            },
-        ]
-
-        # Process input (cast to bfloat16 per official docs)
-        with log_timing(logger, "modal.extract.apply_chat_template"):
-            inputs = self.processor.apply_chat_template(
-                messages,
-                add_generation_prompt=True,
-                tokenize=True,
-                return_dict=True,
-                return_tensors="pt",
-            ).to(self.model.device, dtype=torch.bfloat16)
+        messages = build_extraction_messages(prompt, pil_image)
+        response = self._generate_with_messages([messages], max_new_tokens)[0]
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Raw response (head): %s", response[:500])
+            if len(response) > 500:
+                logger.debug("Raw response (tail): %s", response[-300:])
 
-        # Generate response
-        with torch.inference_mode():
-            with log_timing(logger, "modal.extract.generate"):
-                outputs = self.model.generate(
-                    **inputs,
-                    max_new_tokens=max_new_tokens,
-                    do_sample=False,
-                )
+        logger.info("Modal response size (raw=%d)", len(response))
+        return response
 
-        # Decode response (skip input tokens)
-        input_len = inputs["input_ids"].shape[-1]
-        output_tokens = outputs[0].shape[-1] - input_len
+    @modal.method()
+    def extract_batch(
+        self,
+        images_bytes: list[bytes],
+        prompt: str,
+        max_new_tokens: int = MAX_NEW_TOKENS_DEFAULT,
+    ) -> list[str]:
+        """
+        Extract information from several images with one generate call.
+
+        Args:
+            images_bytes: Raw bytes of each image file
+            prompt: Extraction prompt shared by every image
+            max_new_tokens: Generation limit (task-specific)
+
+        Returns:
+            One model response per image, in input order
+        """
         logger.info(
-            "Modal tokens (input=%d, output=%d)", input_len, max(output_tokens, 0)
+            "Modal extract_batch start (images=%d, max_new_tokens=%d)",
+            len(images_bytes),
+            max_new_tokens,
         )
-        with log_timing(logger, "modal.extract.decode_output"):
-            response = self.processor.decode(
-                outputs[0][input_len:], skip_special_tokens=True
-            )
-        logger.debug("Raw response (head): %s", response[:500])
-        if len(response) > 500:
-            logger.debug("Raw response (tail): %s", response[-300:])
+        with log_timing(logger, "modal.extract.decode_images"):
+            pil_images = [self._decode_image(b) for b in images_bytes]
 
-        logger.info("Modal response size (raw=%d)", len(response))
-        return response
+        conversations = [build_extraction_messages(prompt, img) for img in pil_images]
+        responses = self._generate_with_messages(conversations, max_new_tokens)
+        logger.info(
+            "Modal batch response sizes (raw=%s)", [len(r) for r in responses]
+        )
+        return responses
 
 
 @app.local_entrypoint()
@@ -1,11 +1,286 @@
 """Utility functions for MedGemma inference."""
 
+import io
 import json
+import logging
+import os
+import re
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Union
 
+from src.inference.constants import (
+    COMPILE_ENV_VAR,
+    DOWNSCALE_JPEG_QUALITY,
+    FLASH_ATTN_ENV_VAR,
+    MAX_IMAGE_EDGE,
+    MAX_NEW_TOKENS_LABS,
+    MAX_NEW_TOKENS_PRESCRIPTION,
+    QUANTIZATION_ENV_VAR,
+    QUANTIZATION_MODES,
+    SKIP_THINKING_ENV_VAR,
+    THINKING_START_TOKEN,
+    WARMUP_IMAGE_EDGE,
+)
 from src.logger import get_logger
+from src.prompts import LAB_RESULTS_PROMPT, PRESCRIPTION_PROMPT, SYSTEM_INSTRUCTION
+
+if TYPE_CHECKING:
+    from PIL.Image import Image as PILImage
 
 logger = get_logger(__name__)
 
+# Backends accept a file path, the already-read image bytes, or a decoded
+# PIL image (e.g. from a notebook), so callers never need a disk round-trip
+ImageInput = Union[str, Path, bytes, "PILImage"]
+
+_EXIF_ORIENTATION_TAG = 0x0112
+
+# Scanning for braces in C skips the (often long) thinking text between them
+_BRACE_RE = re.compile(r"[{}]")
+
+
+def _is_pil_image(image: Any) -> bool:
+    from PIL import Image
+
+    return isinstance(image, Image.Image)
+
+
+def read_image_bytes(image: ImageInput) -> bytes:
+    """Return the image bytes, reading from disk only when given a path."""
+    if isinstance(image, bytes):
+        return image
+    if _is_pil_image(image):
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        return buffer.getvalue()
+    image_path = Path(image)
+    if not image_path.exists():
+        raise FileNotFoundError(f"Image not found: {image_path}")
+    return image_path.read_bytes()
+
+
+def open_image(image: ImageInput, max_edge: int | None = None) -> "PILImage":
+    """Return an RGB PIL image, decoding only when not given one already.
+
+    EXIF orientation is applied (as downscale_image_bytes does), so rotated
+    phone photos reach the model upright on every backend. With max_edge,
+    oversized images are shrunk in PIL (uint8) so the processor never converts
+    a full-resolution phone photo to a float tensor. JPEGs are also decoded at
+    a reduced scale when possible.
+    """
+    from PIL import Image, ImageOps
+
+    if isinstance(image, Image.Image):
+        pil_image = image
+    else:
+        if isinstance(image, bytes):
+            pil_image = Image.open(io.BytesIO(image))
+        else:
+            image_path = Path(image)
+            if not image_path.exists():
+                raise FileNotFoundError(f"Image not found: {image_path}")
+            pil_image = Image.open(image_path)
+        if max_edge:
+            pil_image.draft("RGB", (max_edge, max_edge))
+
+    # exif_transpose returns a new image, so the caller's is never mutated
+    if pil_image.getexif().get(_EXIF_ORIENTATION_TAG, 1) != 1:
+        pil_image = ImageOps.exif_transpose(pil_image)
+    if pil_image.mode != "RGB":
+        pil_image = pil_image.convert("RGB")
+    if max_edge and max(pil_image.size) > max_edge:
+        # thumbnail() works in place; never mutate the caller's image
+        if pil_image is image:
+            pil_image = pil_image.copy()
+        pil_image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+    return pil_image
+
+
+def downscale_image_bytes(
+    image_bytes: bytes,
+    max_edge: int = MAX_IMAGE_EDGE,
+    quality: int = DOWNSCALE_JPEG_QUALITY,
+) -> bytes:
+    """Shrink an encoded image so its longest edge is at most max_edge.
+
+    Images already within the limit (or that cannot be decoded) are returned
+    unchanged, so the backend still sees the original bytes and errors.
+    """
+    from PIL import Image, ImageOps
+
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            if max(img.size) <= max_edge:
+                return image_bytes
+            # Re-encoding drops EXIF, so bake the orientation in first
+            resized = ImageOps.exif_transpose(img).convert("RGB")
+    except Exception as exc:
+        logger.debug("Could not decode image for downscaling: %s", exc)
+        return image_bytes
+
+    original_size = resized.size
+    resized.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    resized.save(buffer, format="JPEG", quality=quality)
+    logger.info(
+        "Downscaled image %sx%s -> %sx%s (%d -> %d bytes)",
+        original_size[0],
+        original_size[1],
+        resized.width,
+        resized.height,
+        len(image_bytes),
+        buffer.tell(),
+    )
+    return buffer.getvalue()
+
+
+def describe_image(image: ImageInput) -> str:
+    """Short label for logs (never dumps raw bytes)."""
+    if isinstance(image, bytes):
+        return f"<{len(image)} bytes>"
+    if _is_pil_image(image):
+        return f"<image {image.width}x{image.height}>"
+    return str(image)
+
+
+def resolve_quantization_mode() -> str:
+    """Return the weight precision selected with MEDGEMMA_QUANT (default bf16)."""
+    mode = os.environ.get(QUANTIZATION_ENV_VAR, "bf16").strip().lower()
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(
+            f"Invalid {QUANTIZATION_ENV_VAR}={mode!r}. "
+            f"Supported values: {', '.join(QUANTIZATION_MODES)}"
+        )
+    return mode
+
+
+def resolve_attn_implementation() -> str:
+    """Attention kernel to load with: SDPA, or FlashAttention-2 when opted in."""
+    import importlib.util
+
+    if not _env_flag(FLASH_ATTN_ENV_VAR):
+        return "sdpa"
+    if importlib.util.find_spec("flash_attn") is None:
+        logger.warning(
+            "%s is set but flash_attn is not installed; using sdpa",
+            FLASH_ATTN_ENV_VAR,
+        )
+        return "sdpa"
+    return "flash_attention_2"
+
+
+def pick_model_dtype() -> Any:
+    """bfloat16 on GPU, float32 on CPU-only hosts.
+
+    CPUs without native bf16 emulate it and run far slower than float32.
+    float16 is never used: Gemma 3 activations overflow it and produce NaNs.
+    """
+    import torch
+
+    return torch.bfloat16 if torch.cuda.is_available() else torch.float32
+
+
+def model_load_kwargs() -> dict[str, Any]:
+    """Keyword arguments for MedGemma's from_pretrained (dtype, placement, quantization)."""
+    import torch
+
+    dtype = pick_model_dtype()
+    logger.info("Loading MedGemma weights as %s", dtype)
+    kwargs: dict[str, Any] = {
+        "dtype": dtype,  # Use dtype instead of deprecated torch_dtype
+        "device_map": "auto",
+        "attn_implementation": resolve_attn_implementation(),
+    }
+    mode = resolve_quantization_mode()
+    if mode == "bf16":
+        return kwargs
+
+    from transformers import BitsAndBytesConfig
+
+    if mode == "int8":
+        kwargs["quantization_config"] = BitsAndBytesConfig(load_in_8bit=True)
+    else:
+        kwargs["quantization_config"] = BitsAndBytesConfig(
+            load_in_4bit=True,
+            bnb_4bit_compute_dtype=torch.bfloat16,
+            bnb_4bit_quant_type="nf4",
+        )
+    return kwargs
+
+
+def _env_flag(name: str) -> bool:
+    return os.environ.get(name, "").strip().lower() in {"1", "true", "yes"}
+
+
+def compile_enabled() -> bool:
+    """Whether MEDGEMMA_COMPILE asks for a compiled, static-cache decode loop."""
+    return _env_flag(COMPILE_ENV_VAR)
+
+
+def skip_thinking_enabled() -> bool:
+    """Whether MEDGEMMA_SKIP_THINKING asks generate() to skip the thinking segment."""
+    return _env_flag(SKIP_THINKING_ENV_VAR)
+
+
+def configure_generation(model: Any, processor: Any = None) -> None:
+    """Apply opt-in generation settings to a freshly loaded model."""
+    if compile_enabled():
+        # generate() compiles the forward pass when the KV cache is static
+        model.generation_config.cache_implementation = "static"
+        logger.info("Static KV cache enabled; decoding will be torch.compiled")
+    if processor is not None and skip_thinking_enabled():
+        banned = processor.tokenizer(
+            [THINKING_START_TOKEN], add_special_tokens=False
+        ).input_ids
+        model.generation_config.bad_words_ids = banned
+        logger.info("Thinking mode disabled; %s is banned", THINKING_START_TOKEN)
+
+
+def build_extraction_messages(prompt: str, image: Any) -> list[dict[str, Any]]:
+    """Build the chat messages for a single image extraction.
+
+    Follows the official MedGemma docs: system instruction, then a user turn
+    with the prompt text before the image.
+    """
+    return [
+        {
+            "role": "system",
+            "content": [{"type": "text", "text": SYSTEM_INSTRUCTION}],
+        },
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": prompt},
+                {"type": "image", "image": image},
+            ],
+        },
+    ]
+
+
+def build_warmup_messages(prompt: str = "OK") -> list[dict[str, Any]]:
+    """Chat messages for a throwaway generate call on a blank image."""
+    from PIL import Image
+
+    blank = Image.new("RGB", (WARMUP_IMAGE_EDGE, WARMUP_IMAGE_EDGE), "white")
+    return build_extraction_messages(prompt, blank)
+
+
+def build_warmup_generations() -> list[tuple[list[dict[str, Any]], int]]:
+    """(messages, max_new_tokens) pairs to generate once after the model loads.
+
+    Normally a single one-token call. With MEDGEMMA_COMPILE, the compiled
+    decode step is specialized on the prompt length and static cache size, so
+    each task's real prompt and token budget is run instead. This is slow, but
+    single-image requests then reuse those graphs (batches still compile on
+    first use).
+    """
+    if not compile_enabled():
+        return [(build_warmup_messages(), 1)]
+    return [
+        (build_warmup_messages(PRESCRIPTION_PROMPT), MAX_NEW_TOKENS_PRESCRIPTION),
+        (build_warmup_messages(LAB_RESULTS_PROMPT), MAX_NEW_TOKENS_LABS),
+    ]
+
 
 def extract_json_from_response(response: str) -> str:
     """Extract JSON from model response, handling thinking mode gracefully.
@@ -58,12 +333,13 @@ def extract_json_from_response(response: str) -> str:
     json_start = -1
     json_candidates = []
 
-    for i, char in enumerate(stripped):
-        if char == "{":
+    for match in _BRACE_RE.finditer(stripped):
+        i = match.start()
+        if match.group() == "{":
             if brace_depth == 0:
                 json_start = i
             brace_depth += 1
-        elif char == "}":
+        else:
             brace_depth -= 1
             if brace_depth == 0 and json_start != -1:
                 candidate = stripped[json_start : i + 1]
@@ -82,17 +358,19 @@ def extract_json_from_response(response: str) -> str:
             continue
 
     # Strategy 4: Return cleaned response (let caller handle parse failure)
-    open_braces = stripped.count("{")
-    close_braces = stripped.count("}")
-    open_brackets = stripped.count("[")
-    close_brackets = stripped.count("]")
-    if open_braces != close_braces or open_brackets != close_brackets:
-        logger.debug(
-            "Unbalanced JSON delimiters: {=%d, }=%d, [=%d, ]=%d",
-            open_braces,
-            close_braces,
-            open_brackets,
-            close_brackets,
-        )
+    # The delimiter tally only feeds a debug log, so skip the scans otherwise
+    if logger.isEnabledFor(logging.DEBUG):
+        open_braces = stripped.count("{")
+        close_braces = stripped.count("}")
+        open_brackets = stripped.count("[")
+        close_brackets = stripped.count("]")
+        if open_braces != close_braces or open_brackets != close_brackets:
+            logger.debug(
+                "Unbalanced JSON delimiters: {=%d, }=%d, [=%d, ]=%d",
+                open_braces,
+                close_braces,
+                open_brackets,
+                close_brackets,
+            )
     logger.debug("Returning stripped response (len=%d)", len(stripped))
     return stripped
@@ -9,6 +9,7 @@ consult a healthcare professional for medical advice.
 """
 
 from dataclasses import dataclass
+from functools import lru_cache
 
 
 @dataclass
@@ -118,6 +119,50 @@ KNOWN_INTERACTIONS: dict[tuple[str, str], dict[str, str]] = {
 }
 
 
+# Interacting partners per drug, built once from KNOWN_INTERACTIONS so the
+# pairwise scan only looks at medications that have any known interaction
+_INTERACTION_PARTNERS: dict[str, dict[str, dict[str, str]]] = {}
+for (_drug_a, _drug_b), _data in KNOWN_INTERACTIONS.items():
+    _INTERACTION_PARTNERS.setdefault(_drug_a, {})[_drug_b] = _data
+    _INTERACTION_PARTNERS.setdefault(_drug_b, {})[_drug_a] = _data
+
+_SUFFIXES_TO_REMOVE = (
+    " tabletas",
+    " tableta",
+    " capsulas",
+    " capsula",
+    " mg",
+    " ml",
+    " gotas",
+    " jarabe",
+    " suspension",
+    " inyectable",
+)
+
+# Map common brand names to generic names (Colombian market)
+_BRAND_TO_GENERIC = {
+    "glucophage": "metformina",
+    "glafornil": "metformina",
+    "aspirina": "aspirina",  # keep as is
+    "cardioaspirina": "aspirina",
+    "coumadin": "warfarina",
+    "sintrom": "acenocumarol",
+    "plavix": "clopidogrel",
+    "lipitor": "atorvastatina",
+    "crestor": "rosuvastatina",
+    "viagra": "sildenafil",
+    "cialis": "tadalafil",
+    "rivotril": "clonazepam",
+    "alprazolam": "alprazolam",
+    "xanax": "alprazolam",
+    "eutirox": "levotiroxina",
+    "synthroid": "levotiroxina",
+}
+
+_SEVERITY_ORDER = {"alta": 0, "media": 1, "baja": 2}
+
+
+@lru_cache(maxsize=1024)
 def normalize_drug_name(name: str) -> str:
     """Normalize a drug name for comparison.
 
@@ -127,43 +172,11 @@ def normalize_drug_name(name: str) -> str:
     name = name.lower().strip()
 
     # Remove common suffixes
-    suffixes_to_remove = [
-        " tabletas",
-        " tableta",
-        " capsulas",
-        " capsula",
-        " mg",
-        " ml",
-        " gotas",
-        " jarabe",
-        " suspension",
-        " inyectable",
-    ]
-    for suffix in suffixes_to_remove:
+    for suffix in _SUFFIXES_TO_REMOVE:
         if name.endswith(suffix):
             name = name[: -len(suffix)]
 
-    # Map common brand names to generic names (Colombian market)
-    brand_to_generic = {
-        "glucophage": "metformina",
-        "glafornil": "metformina",
-        "aspirina": "aspirina",  # keep as is
-        "cardioaspirina": "aspirina",
-        "coumadin": "warfarina",
-        "sintrom": "acenocumarol",
-        "plavix": "clopidogrel",
-        "lipitor": "atorvastatina",
-        "crestor": "rosuvastatina",
-        "viagra": "sildenafil",
-        "cialis": "tadalafil",
-        "rivotril": "clonazepam",
-        "alprazolam": "alprazolam",
-        "xanax": "alprazolam",
-        "eutirox": "levotiroxina",
-        "synthroid": "levotiroxina",
-    }
-
-    return brand_to_generic.get(name, name)
+    return _BRAND_TO_GENERIC.get(name, name)
 
 
 def check_interactions(medications: list[str]) -> list[Interaction]:
@@ -189,14 +202,14 @@ def check_interactions(medications: list[str]) -> list[Interaction]:
 
     warnings = []
 
-    # Check each pair of medications
+    # Check each pair of medications, skipping drugs with no known partners
     for i, (orig1, norm1) in enumerate(normalized):
+        partners = _INTERACTION_PARTNERS.get(norm1)
+        if not partners:
+            continue
         for orig2, norm2 in normalized[i + 1 :]:
-            # Create sorted key for lookup
-            key = tuple(sorted([norm1, norm2]))
-
-            if key in KNOWN_INTERACTIONS:
-                interaction_data = KNOWN_INTERACTIONS[key]
+            interaction_data = partners.get(norm2)
+            if interaction_data is not None:
                 warnings.append(
                     Interaction(
                         drugs=(orig1, orig2),
@@ -206,12 +219,38 @@ def check_interactions(medications: list[str]) -> list[Interaction]:
                 )
 
     # Sort by severity (alta first, then media, then baja)
-    severity_order = {"alta": 0, "media": 1, "baja": 2}
-    warnings.sort(key=lambda x: severity_order.get(x.severity, 3))
+    warnings.sort(key=lambda x: _SEVERITY_ORDER.get(x.severity, 3))
 
     return warnings
 
 
+def order_interactions(
+    interactions: list[Interaction] | tuple[Interaction, ...], medications: list[str]
+) -> list[Interaction]:
+    """Orient and sort interactions as check_interactions would for this order.
+
+    Lets interactions found for a set of medications be reused whatever order
+    the medications were entered in.
+    """
+    position = {med: i for i, med in enumerate(medications)}
+    ordered = [
+        Interaction(
+            drugs=tuple(sorted(interaction.drugs, key=position.__getitem__)),
+            severity=interaction.severity,
+            warning=interaction.warning,
+        )
+        for interaction in interactions
+    ]
+    ordered.sort(
+        key=lambda x: (
+            _SEVERITY_ORDER.get(x.severity, 3),
+            position[x.drugs[0]],
+            position[x.drugs[1]],
+        )
+    )
+    return ordered
+
+
 def main():
     """Smoke test for interaction checker."""
     print("=" * 60)
@@ -71,6 +71,10 @@ def log_timing(
         with log_timing(logger, "load_model"):
             ...
     """
+    if not logger.isEnabledFor(level):
+        yield
+        return
+
     start = perf_counter()
     try:
         yield
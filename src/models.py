@@ -18,8 +18,26 @@ import json
 
 # --- MedGemma Extraction Models ---
 
+_JSON_DECODER = json.JSONDecoder()
 
-@dataclass
+
+def _load_json_object(json_str: str) -> dict:
+    """Parse a JSON response, tolerating text before or after the object.
+
+    The fallback decodes in one pass from the first "{" and stops where the
+    object ends, so trailing text (even with braces) is ignored.
+    """
+    try:
+        return json.loads(json_str)
+    except json.JSONDecodeError:
+        json_start = json_str.find("{")
+        if json_start < 0:
+            return {}
+        data, _end = _JSON_DECODER.raw_decode(json_str, json_start)
+        return data
+
+
+@dataclass(slots=True)
 class MedicationItem:
     """Single medication extracted from a prescription."""
 
@@ -30,7 +48,7 @@ class MedicationItem:
     instrucciones: str = ""
 
 
-@dataclass
+@dataclass(slots=True)
 class PrescriptionExtraction:
     """Extracted data from a prescription image."""
 
@@ -42,17 +60,7 @@ class PrescriptionExtraction:
     def from_json(cls, json_str: str) -> "PrescriptionExtraction":
         """Parse JSON response into PrescriptionExtraction."""
         try:
-            # Try direct parse first, then fallback to slicing
-            try:
-                data = json.loads(json_str)
-            except json.JSONDecodeError:
-                json_start = json_str.find("{")
-                json_end = json_str.rfind("}") + 1
-                if json_start >= 0 and json_end > json_start:
-                    json_str_clean = json_str[json_start:json_end]
-                    data = json.loads(json_str_clean)
-                else:
-                    data = {}
+            data = _load_json_object(json_str)
 
             if "medicamentos" not in data:
                 return cls(raw_response=json_str, parse_success=False)
@@ -77,7 +85,7 @@ class PrescriptionExtraction:
         return cls(raw_response=json_str, parse_success=False)
 
 
-@dataclass
+@dataclass(slots=True)
 class LabResultItem:
     """Single lab result value."""
 
@@ -88,7 +96,7 @@ class LabResultItem:
     estado: str = ""  # "normal", "alto", "bajo"
 
 
-@dataclass
+@dataclass(slots=True)
 class LabResultExtraction:
     """Extracted data from a lab result image."""
 
@@ -100,16 +108,7 @@ class LabResultExtraction:
     def from_json(cls, json_str: str) -> "LabResultExtraction":
         """Parse JSON response into LabResultExtraction."""
         try:
-            try:
-                data = json.loads(json_str)
-            except json.JSONDecodeError:
-                json_start = json_str.find("{")
-                json_end = json_str.rfind("}") + 1
-                if json_start >= 0 and json_end > json_start:
-                    json_str_clean = json_str[json_start:json_end]
-                    data = json.loads(json_str_clean)
-                else:
-                    data = {}
+            data = _load_json_object(json_str)
 
             if "resultados" not in data:
                 return cls(raw_response=json_str, parse_success=False)
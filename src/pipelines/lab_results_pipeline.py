@@ -12,11 +12,28 @@ STATUS_EMOJI = {
     "alto": "🔴",
     "bajo": "🟡",
 }
+UNKNOWN_STATUS_EMOJI = "⚪"
+
+# Out-of-range statuses and how they read in the notes ("está por encima...")
+_OUT_OF_RANGE_DIRECTION = {
+    "alto": "por encima",
+    "bajo": "por debajo",
+}
+
+_LAB_HEADER = (
+    "| Estado | Prueba | Valor | Unidad | Rango Referencia |\n"
+    "|:------:|--------|-------|--------|------------------|\n"
+)
+_LAB_LEGEND = "\n\n\n**Leyenda:** 🟢 Normal | 🔴 Alto | 🟡 Bajo"
 
 
 def get_status_emoji(estado: str) -> str:
     """Get emoji for lab result status."""
-    return STATUS_EMOJI.get(estado.lower(), "⚪")
+    return STATUS_EMOJI.get(estado.lower(), UNKNOWN_STATUS_EMOJI)
+
+
+def _format_lab_row(emoji: str, r: LabResultItem) -> str:
+    return f"| {emoji} | {r.nombre_prueba} | {r.valor} | {r.unidad} | {r.rango_referencia} |"
 
 
 def format_lab_results_table(results: list[LabResultItem]) -> str:
@@ -24,16 +41,11 @@ def format_lab_results_table(results: list[LabResultItem]) -> str:
     if not results:
         return "No se encontraron resultados."
 
-    md = "| Estado | Prueba | Valor | Unidad | Rango Referencia |\n"
-    md += "|:------:|--------|-------|--------|------------------|\n"
-
-    for r in results:
-        emoji = get_status_emoji(r.estado)
-        md += f"| {emoji} | {r.nombre_prueba} | {r.valor} | {r.unidad} | {r.rango_referencia} |\n"
-
-    md += "\n\n**Leyenda:** 🟢 Normal | 🔴 Alto | 🟡 Bajo"
-
-    return md
+    rows = "\n".join(
+        _format_lab_row(STATUS_EMOJI.get(r.estado.lower(), UNKNOWN_STATUS_EMOJI), r)
+        for r in results
+    )
+    return _LAB_HEADER + rows + _LAB_LEGEND
 
 
 def build_lab_results_output(extraction: LabResultExtraction) -> str:
@@ -41,22 +53,30 @@ def build_lab_results_output(extraction: LabResultExtraction) -> str:
     if not extraction.resultados:
         return "No se encontraron resultados."
 
-    md = f"## Resultados de Laboratorio ({len(extraction.resultados)} pruebas)\n\n"
-    md += format_lab_results_table(extraction.resultados)
-
-    abnormal = [
-        r for r in extraction.resultados if r.estado.lower() in ("alto", "bajo")
-    ]
-    if abnormal:
-        md += "\n\n### Valores Fuera de Rango\n\n"
-        for r in abnormal:
-            status = "por encima" if r.estado.lower() == "alto" else "por debajo"
-            md += (
+    # One pass builds the table rows and the out-of-range notes together
+    rows: list[str] = []
+    abnormal_notes: list[str] = []
+    for r in extraction.resultados:
+        estado = r.estado.lower()
+        rows.append(_format_lab_row(STATUS_EMOJI.get(estado, UNKNOWN_STATUS_EMOJI), r))
+        status = _OUT_OF_RANGE_DIRECTION.get(estado)
+        if status:
+            abnormal_notes.append(
                 f"- **{r.nombre_prueba}**: Su valor ({r.valor} {r.unidad}) "
                 f"está {status} del rango normal ({r.rango_referencia}). "
                 "Consulte con su médico.\n"
             )
 
-    md += f"\n\n**Aviso:** {DISCLAIMER_FULL} {DISCLAIMER_SHORT}"
+    parts = [
+        f"## Resultados de Laboratorio ({len(extraction.resultados)} pruebas)\n\n",
+        _LAB_HEADER,
+        "\n".join(rows),
+        _LAB_LEGEND,
+    ]
+    if abnormal_notes:
+        parts.append("\n\n### Valores Fuera de Rango\n\n")
+        parts.extend(abnormal_notes)
+
+    parts.append(f"\n\n**Aviso:** {DISCLAIMER_FULL} {DISCLAIMER_SHORT}")
 
-    return md
+    return "".join(parts)
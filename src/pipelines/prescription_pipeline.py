@@ -43,6 +43,13 @@ def format_medication_card(med: MedicationItem, index: int) -> str:
 """
 
 
+def format_medications_markdown(medications: list[MedicationItem]) -> str:
+    """Format the extracted medications section (no enrichment needed)."""
+    parts = [f"## Medicamentos Encontrados ({len(medications)})\n\n"]
+    parts.extend(format_medication_card(med, i) for i, med in enumerate(medications, 1))
+    return "".join(parts)
+
+
 def build_prescription_output(
     extraction: PrescriptionExtraction,
     limit: int = 5,
@@ -67,16 +74,14 @@ def build_prescription_output(
             explanations_markdown="",
         )
 
-    meds_md = f"## Medicamentos Encontrados ({len(extraction.medicamentos)})\n\n"
+    meds_md = format_medications_markdown(extraction.medicamentos)
     enriched_results: list[EnrichedMedication] = []
     generics_sections: list[str] = []
     price_sections: list[str] = []
     explanation_sections: list[str] = []
     warning_sections: list[str] = []
 
-    for i, med in enumerate(extraction.medicamentos, 1):
-        meds_md += format_medication_card(med, i)
-
+    for med in extraction.medicamentos:
         if not med.nombre_medicamento:
             continue
 
@@ -97,14 +102,15 @@ def build_prescription_output(
         if enriched.match.record and enriched.generics:
             ingredient = enriched.match.record.principioactivo
             if ingredient:
-                generics_md = f"**Alternativas para {ingredient}:**\n\n"
+                generic_lines = [f"**Alternativas para {ingredient}:**\n\n"]
                 for g in enriched.generics[:3]:
                     is_generic = "GENERICO" in g.descripcioncomercial.upper()
                     badge = " [GENÉRICO]" if is_generic else ""
-                    generics_md += (
+                    generic_lines.append(
                         f"- {g.producto}{badge} "
                         f"({g.concentracion_valor}{g.unidadmedida})\n"
                     )
+                generics_md = "".join(generic_lines)
                 generics_sections.append(f"### {med.nombre_medicamento}\n{generics_md}")
 
         if enriched.price_summary:
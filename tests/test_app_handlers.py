@@ -1,15 +1,38 @@
 """Integration-style tests for app handlers and backend fallback behavior."""
 
+import asyncio
+
 import pytest
 
 import src.app as app_module
-from src.models import MedicationItem, PrescriptionExtraction
+from src.interactions import Interaction
+from src.models import (
+    LabResultExtraction,
+    LabResultItem,
+    MedicationItem,
+    PrescriptionExtraction,
+)
 from src.pipelines.prescription_pipeline import PrescriptionPipelineResult
 
 
+def _collect(updates):
+    """Drain a streaming handler into a list of its updates."""
+
+    async def drain():
+        return [update async for update in updates]
+
+    return asyncio.run(drain())
+
+
 @pytest.fixture(autouse=True)
 def _reset_app_backend_cache():
     app_module._backend_cache.clear()
+    app_module._backend_failures.clear()
+    app_module._extraction_cache.clear()
+    app_module._prescription_output_cache.clear()
+    app_module._get_tracker_displays_cached.cache_clear()
+    app_module._check_interactions_cached.cache_clear()
+    app_module._warmup_started.clear()
 
 
 def test_analyze_prescription_falls_back_to_transformers(monkeypatch):
@@ -55,9 +78,16 @@ def test_analyze_prescription_falls_back_to_transformers(monkeypatch):
         ),
     )
 
-    result = app_module.analyze_prescription("/tmp/fake-prescription.jpg")
+    updates = _collect(app_module.analyze_prescription("/tmp/fake-prescription.jpg"))
 
-    assert result == ("meds", "generics", "prices", "explanations")
+    assert updates[0] == (app_module.PENDING_EXTRACTION_MD, "", "", "")
+    assert "METFORMINA" in updates[1][0]
+    assert updates[1][1:] == (
+        app_module.PENDING_GENERICS_MD,
+        app_module.PENDING_PRICES_MD,
+        app_module.PENDING_EXPLANATIONS_MD,
+    )
+    assert updates[-1] == ("meds", "generics", "prices", "explanations")
     assert modal_backend.calls == 1
     assert transformers_backend.calls == 1
 
@@ -89,9 +119,420 @@ def test_analyze_lab_results_returns_stable_error_when_all_backends_fail(monkeyp
         lambda _result: "should not be returned",
     )
 
-    output = app_module.analyze_lab_results("/tmp/fake-lab.jpg")
+    pending, output = _collect(app_module.analyze_lab_results("/tmp/fake-lab.jpg"))
+
+    assert pending == app_module.PENDING_LAB_MD
 
     assert output.startswith("Error al analizar los resultados:")
     assert "No se logró extraer información con los backends configurados" in output
     assert modal_backend.calls == 1
     assert transformers_backend.calls == 1
+
+
+def test_failing_backend_is_skipped_until_its_cooldown_expires(monkeypatch):
+    class Backend:
+        def __init__(self, fail):
+            self.fail = fail
+            self.calls = 0
+
+        def extract_lab_results(self, _image):
+            self.calls += 1
+            if self.fail:
+                raise RuntimeError("unavailable")
+            return LabResultExtraction(resultados=[LabResultItem()], parse_success=True)
+
+    backends = {"modal": Backend(fail=True), "transformers": Backend(fail=False)}
+    monkeypatch.setenv("INFERENCE_BACKEND", "auto")
+    monkeypatch.setattr(app_module, "get_backend", lambda name: backends[name])
+
+    def extract():
+        return app_module._run_extraction_with_fallback(
+            image=b"img",
+            task_label="lab",
+            method_name="extract_lab_results",
+            is_valid_result=lambda r: r.parse_success,
+        )
+
+    for _ in range(3):
+        extract()
+    assert backends["modal"].calls == app_module.BACKEND_FAILURE_THRESHOLD
+    assert backends["transformers"].calls == 3
+
+    # With every backend cooling down they are still tried rather than failing fast
+    backends["transformers"].fail = True
+    for _ in range(app_module.BACKEND_FAILURE_THRESHOLD + 1):
+        with pytest.raises(RuntimeError):
+            extract()
+    assert backends["modal"].calls == app_module.BACKEND_FAILURE_THRESHOLD + 1
+    assert backends["transformers"].calls == 3 + app_module.BACKEND_FAILURE_THRESHOLD + 1
+
+
+def test_analyze_prescription_reuses_cached_result_for_same_image(monkeypatch, tmp_path):
+    class CountingBackend:
+        def __init__(self):
+            self.calls = 0
+            self.images = []
+
+        def extract_prescription(self, image):
+            self.calls += 1
+            self.images.append(image)
+            return PrescriptionExtraction(
+                medicamentos=[MedicationItem(nombre_medicamento="LOSARTAN")],
+                parse_success=True,
+            )
+
+    backend = CountingBackend()
+    build_calls = []
+
+    def fake_build(*_args, **_kwargs):
+        build_calls.append(1)
+        return PrescriptionPipelineResult(
+            medications_markdown="meds",
+            generics_markdown="generics",
+            prices_markdown="prices",
+            explanations_markdown="explanations",
+        )
+
+    monkeypatch.setenv("INFERENCE_BACKEND", "modal")
+    monkeypatch.setattr(app_module, "get_backend", lambda _name: backend)
+    monkeypatch.setattr(app_module, "build_prescription_output", fake_build)
+    downscaled = []
+    monkeypatch.setattr(
+        app_module,
+        "downscale_image_bytes",
+        lambda image_bytes: downscaled.append(image_bytes) or image_bytes,
+    )
+
+    first = tmp_path / "receta.jpg"
+    first.write_bytes(b"same-image")
+    reupload = tmp_path / "receta-copia.jpg"
+    reupload.write_bytes(b"same-image")
+
+    first_result = _collect(app_module.analyze_prescription(str(first)))[-1]
+    second_updates = _collect(app_module.analyze_prescription(str(reupload)))
+    second_result = second_updates[-1]
+
+    assert first_result == second_result == ("meds", "generics", "prices", "explanations")
+    assert len(second_updates) == 2  # progress message, then the cached output
+    assert backend.calls == 1
+    assert backend.images == [b"same-image"]
+    assert downscaled == [b"same-image"]  # cache hits skip the image decode
+    assert len(build_calls) == 1
+
+
+def test_backend_order_is_parsed_once_per_setting(monkeypatch):
+    monkeypatch.setenv("INFERENCE_BACKEND", " Transformers ")
+    assert app_module._resolve_backend_order() == ("transformers",)
+
+    monkeypatch.setenv("INFERENCE_BACKEND", "gpu")
+    first = app_module._resolve_backend_order()
+    assert first == ("modal", "transformers")
+    assert app_module._resolve_backend_order() is first
+
+
+def test_add_medication_returns_updated_dropdown():
+    current = app_module.TrackedMedications().add("Aspirina")
+    updated_meds, meds_md, cleared, dropdown = asyncio.run(
+        app_module.add_medication("  Warfarina ", current)
+    )
+
+    assert updated_meds.names == ("Aspirina", "Warfarina")
+    assert "Warfarina" in meds_md
+    assert cleared == ""
+    assert [value for _label, value in dropdown.choices] == ["Aspirina", "Warfarina"]
+    assert dropdown.value is None
+
+
+def test_tracker_duplicate_check_is_case_insensitive():
+    current = app_module.TrackedMedications().add("Losartan")
+
+    skip = app_module.gr.skip()
+    for no_op in ("LOSARTAN", "   "):
+        updated_meds, meds_md, cleared, dropdown = asyncio.run(
+            app_module.add_medication(no_op, current)
+        )
+        assert updated_meds is current
+        assert (meds_md, cleared, dropdown) == (skip, "", skip)
+
+    assert asyncio.run(app_module.remove_medication("Ibuprofeno", current)) == (
+        current,
+        skip,
+        skip,
+    )
+
+    # Precomposed vs. combining accent, different case
+    with_accent = app_module.TrackedMedications().add("Acetaminof\u00e9n")
+    assert "ACETAMINOFE\u0301N" in with_accent
+
+    removed, _meds_md, dropdown = asyncio.run(
+        app_module.remove_medication("Losartan", current)
+    )
+    assert removed.names == ()
+    assert "losartan" not in removed
+    assert dropdown.choices == []
+
+    assert asyncio.run(app_module.clear_medications(removed)) == (removed, skip, skip)
+    cleared_meds, meds_md, dropdown = asyncio.run(
+        app_module.clear_medications(current)
+    )
+    assert cleared_meds.names == ()
+    assert meds_md == app_module.EMPTY_MEDS_MD
+    assert dropdown.choices == []
+
+
+def test_refresh_interactions_renders_latest_state(monkeypatch):
+    monkeypatch.setattr(app_module, "INTERACTIONS_DEBOUNCE_SECONDS", 0)
+    meds = app_module.TrackedMedications().add("Warfarina").add("Aspirina")
+
+    async def burst():
+        return await asyncio.gather(
+            app_module.refresh_interactions(meds.remove("Aspirina")),
+            app_module.refresh_interactions(meds),
+        )
+
+    single, both = asyncio.run(burst())
+
+    assert single == app_module.EMPTY_INTERACTIONS_MD
+    assert "Warfarina + Aspirina" in both or "Aspirina + Warfarina" in both
+
+
+def test_get_tracker_displays_memoizes_interaction_check(monkeypatch):
+    calls = []
+
+    def counting_check(medications):
+        calls.append(list(medications))
+        return []
+
+    monkeypatch.setattr(app_module, "check_interactions", counting_check)
+
+    first = app_module.get_tracker_displays(["Losartan", "Potasio"])
+    second = app_module.get_tracker_displays(["Losartan", "Potasio"])
+    empty = app_module.get_tracker_displays([])
+    single = app_module.get_tracker_displays(["Losartan"])
+
+    reordered = app_module.get_tracker_displays(["Potasio", "Losartan"])
+
+    assert first == second
+    assert reordered != first  # list order is preserved in the display
+    assert calls == [["Losartan", "Potasio"]]
+    assert empty == (app_module.EMPTY_MEDS_MD, app_module.EMPTY_INTERACTIONS_MD)
+    assert single == (
+        "## Mis Medicamentos\n\n1. Losartan\n",
+        app_module.EMPTY_INTERACTIONS_MD,
+    )
+
+
+def test_format_interactions_renders_each_interaction_with_badge():
+    interactions = [
+        Interaction(
+            drugs=("warfarina", "aspirina"),
+            severity="alta",
+            warning="Riesgo de sangrado.",
+        ),
+        Interaction(drugs=("a", "b"), severity="desconocida", warning="Otra."),
+    ]
+
+    md = app_module.format_interactions(interactions)
+
+    assert md.startswith("## ⚠️ Interacciones Detectadas\n\n")
+    assert (
+        "### warfarina + aspirina\n\n**Severidad:** 🔴 **ALTA**\n\n"
+        "Riesgo de sangrado.\n\n---\n"
+    ) in md
+    assert "**Severidad:** ⚪" in md
+    assert app_module.format_tracked_medications(["A", "B"]) == (
+        "## Mis Medicamentos\n\n1. A\n2. B\n"
+    )
+
+
+def test_backend_warmup_falls_back_and_runs_once(monkeypatch):
+    class Backend:
+        def __init__(self, fail):
+            self.fail = fail
+            self.warmups = 0
+
+        def warmup(self):
+            self.warmups += 1
+            if self.fail:
+                raise RuntimeError("cold start failed")
+
+    backends = {"modal": Backend(fail=True), "transformers": Backend(fail=False)}
+    monkeypatch.setenv("INFERENCE_BACKEND", "auto")
+    monkeypatch.setattr(app_module, "get_backend", lambda name: backends[name])
+
+    threads = []
+    real_thread = app_module.threading.Thread
+
+    def recording_thread(*args, **kwargs):
+        thread = real_thread(*args, **kwargs)
+        threads.append(thread)
+        return thread
+
+    monkeypatch.setattr(app_module.threading, "Thread", recording_thread)
+
+    app_module.start_backend_warmup()
+    app_module.start_backend_warmup()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert len(threads) == 1
+    assert backends["modal"].warmups == 1
+    assert backends["transformers"].warmups == 1
+
+
+def test_analyze_prescription_for_session_skips_unchanged_panels(monkeypatch):
+    async def fake_analyze(_image_path):
+        yield ("meds", "...", "...", "...")
+        yield ("meds", "generics", "prices-new", "explanations")
+
+    monkeypatch.setattr(app_module, "analyze_prescription", fake_analyze)
+    skip = app_module.gr.skip()
+
+    first, streamed = _collect(app_module.analyze_prescription_for_session("x.jpg", None))
+    assert first == ("meds", "...", "...", "...", ("meds", "...", "...", "..."))
+    # The medications panel is not re-sent by the streamed follow-up
+    assert streamed[:4] == (skip, "generics", "prices-new", "explanations")
+
+    async def fake_cached_analyze(_image_path):
+        yield ("meds", "generics", "prices-new", "explanations")
+
+    monkeypatch.setattr(app_module, "analyze_prescription", fake_cached_analyze)
+
+    previous = ("meds", "generics", "prices-old", "explanations")
+    (second,) = _collect(app_module.analyze_prescription_for_session("x.jpg", previous))
+    assert second[:4] == (skip, skip, "prices-new", skip)
+    assert second[4] == ("meds", "generics", "prices-new", "explanations")
+
+
+def test_analyze_all_runs_both_analyses_concurrently(monkeypatch):
+    async def run():
+        lab_started = asyncio.Event()
+
+        async def fake_prescription(_image_path):
+            yield ("meds", "...", "...", "...")
+            # Only completes if the lab analysis is running at the same time
+            await asyncio.wait_for(lab_started.wait(), timeout=1)
+            yield ("meds", "generics", "prices", "explanations")
+
+        async def fake_lab(_image_path):
+            lab_started.set()
+            yield "..."
+            yield "labs"
+
+        monkeypatch.setattr(app_module, "analyze_prescription", fake_prescription)
+        monkeypatch.setattr(app_module, "analyze_lab_results", fake_lab)
+
+        both = await app_module.analyze_all("receta.jpg", "examen.jpg", None)
+        lab_only = await app_module.analyze_all(None, "examen.jpg", None)
+        return both, lab_only
+
+    both, lab_only = asyncio.run(run())
+
+    final = ("meds", "generics", "prices", "explanations")
+    assert both == (*final, final, "labs")
+    assert lab_only == (app_module.gr.skip(),) * 5 + ("labs",)
+
+
+def test_analyze_prescription_reuses_output_for_identical_extraction(monkeypatch, tmp_path):
+    class Backend:
+        def __init__(self):
+            self.calls = 0
+
+        def extract_prescription(self, _image):
+            self.calls += 1
+            return PrescriptionExtraction(
+                medicamentos=[MedicationItem(nombre_medicamento="LOSARTAN", dosis="50 mg")],
+                parse_success=True,
+            )
+
+    backend = Backend()
+    build_calls = []
+
+    def fake_build(*_args, **_kwargs):
+        build_calls.append(1)
+        return PrescriptionPipelineResult(
+            medications_markdown="meds",
+            generics_markdown="generics",
+            prices_markdown="prices",
+            explanations_markdown="explanations",
+        )
+
+    monkeypatch.setenv("INFERENCE_BACKEND", "modal")
+    monkeypatch.setattr(app_module, "get_backend", lambda _name: backend)
+    monkeypatch.setattr(app_module, "build_prescription_output", fake_build)
+
+    photo = tmp_path / "receta.jpg"
+    photo.write_bytes(b"photo-1")
+    retake = tmp_path / "receta-otra-foto.jpg"
+    retake.write_bytes(b"photo-2")
+
+    _collect(app_module.analyze_prescription(str(photo)))
+    _collect(app_module.analyze_prescription(str(retake)))
+
+    assert backend.calls == 2
+    assert len(build_calls) == 1
+
+
+def test_prescription_output_key_handles_list_valued_fields():
+    def extraction(dosis):
+        return PrescriptionExtraction(
+            medicamentos=[MedicationItem(nombre_medicamento="LOSARTAN", dosis=dosis)],
+            parse_success=True,
+        )
+
+    key = app_module._prescription_output_key(extraction(["50 mg"]), limit=5)
+
+    assert hash(key)
+    assert key == app_module._prescription_output_key(extraction(["50 mg"]), limit=5)
+    assert key != app_module._prescription_output_key(extraction("50 mg"), limit=5)
+
+
+def test_extraction_disk_cache_survives_memory_cache_reset(monkeypatch, tmp_path):
+    raw = '{"medicamentos": [{"nombre_medicamento": "LOSARTAN"}]}'
+
+    class Backend:
+        def __init__(self):
+            self.calls = 0
+
+        def extract_prescription(self, _image):
+            self.calls += 1
+            return app_module.parse_prescription_response(raw)
+
+    backend = Backend()
+    monkeypatch.setenv("INFERENCE_BACKEND", "modal")
+    monkeypatch.setenv("EXTRACTION_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(app_module, "get_backend", lambda _name: backend)
+
+    def extract():
+        return app_module._run_extraction_with_fallback(
+            image=b"image",
+            task_label="prescription",
+            method_name="extract_prescription",
+            is_valid_result=lambda r: r.parse_success and bool(r.medicamentos),
+            image_digest="abc123",
+        )
+
+    first = extract()
+    app_module._extraction_cache.clear()  # simulate an app restart
+    second = extract()
+
+    assert backend.calls == 1
+    assert second.medicamentos == first.medicamentos
+    (entry,) = (tmp_path / "cache").iterdir()
+    assert entry.name.startswith("extract_prescription-")
+    assert entry.name.endswith("-abc123")
+    assert entry.read_text() == raw
+
+    # A different prompt/model setup must not reuse the saved response
+    app_module._extraction_cache.clear()
+    monkeypatch.setitem(app_module._EXTRACTION_FINGERPRINTS, "extract_prescription", "new")
+    extract()
+    assert backend.calls == 2
+
+    # Nor may a quantized or no-thinking model reuse full-precision responses
+    for name, value in (("MEDGEMMA_QUANT", "int8"), ("MEDGEMMA_SKIP_THINKING", "1")):
+        app_module._extraction_cache.clear()
+        monkeypatch.setenv(name, value)
+        calls_before = backend.calls
+        extract()
+        assert backend.calls == calls_before + 1
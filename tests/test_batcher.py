@@ -0,0 +1,82 @@
+"""Unit tests for the extraction micro-batcher."""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src.inference.batcher import MicroBatcher
+
+
+def test_concurrent_submits_share_one_batch():
+    calls: list[list[str]] = []
+    release = threading.Event()
+
+    def batch_fn(items):
+        calls.append(list(items))
+        release.wait(timeout=5)
+        return [item.upper() for item in items]
+
+    batcher = MicroBatcher(batch_fn, max_batch_size=4, max_wait_s=0.5)
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        futures = [pool.submit(batcher.submit, item) for item in ("a", "b", "c")]
+        release.set()
+        results = [f.result(timeout=5) for f in futures]
+
+    assert results == ["A", "B", "C"]
+    assert len(calls) == 1
+    assert sorted(calls[0]) == ["a", "b", "c"]
+
+
+def test_batch_respects_max_size():
+    sizes: list[int] = []
+
+    def batch_fn(items):
+        sizes.append(len(items))
+        return items
+
+    batcher = MicroBatcher(batch_fn, max_batch_size=2, max_wait_s=0.2)
+
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        results = list(pool.map(batcher.submit, range(5)))
+
+    assert results == [0, 1, 2, 3, 4]
+    assert max(sizes) <= 2
+    assert sum(sizes) == 5
+
+
+def test_batch_errors_reach_every_caller():
+    def batch_fn(_items):
+        raise RuntimeError("backend unavailable")
+
+    batcher = MicroBatcher(batch_fn, max_wait_s=0.01)
+
+    with pytest.raises(RuntimeError, match="backend unavailable"):
+        batcher.submit("receta.jpg")
+
+
+def test_bad_item_only_fails_its_own_caller():
+    calls: list[list[str]] = []
+    release = threading.Event()
+
+    def batch_fn(items):
+        calls.append(list(items))
+        release.wait(timeout=5)
+        if "corrupta.jpg" in items:
+            raise ValueError("cannot identify image file")
+        return [item.upper() for item in items]
+
+    batcher = MicroBatcher(batch_fn, max_batch_size=4, max_wait_s=0.5)
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        good = pool.submit(batcher.submit, "receta.jpg")
+        bad = pool.submit(batcher.submit, "corrupta.jpg")
+        release.set()
+
+        assert good.result(timeout=5) == "RECETA.JPG"
+        with pytest.raises(ValueError, match="cannot identify"):
+            bad.result(timeout=5)
+
+    assert sorted(calls[0]) == ["corrupta.jpg", "receta.jpg"]
+    assert sorted(map(tuple, calls[1:])) == [("corrupta.jpg",), ("receta.jpg",)]
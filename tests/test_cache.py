@@ -0,0 +1,38 @@
+"""Unit tests for the in-process and on-disk caches."""
+
+import os
+import time
+
+from src.cache import DiskTextCache, LRUCache
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache: LRUCache[str, int] = LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+
+
+def test_disk_cache_drops_expired_entries(tmp_path):
+    cache = DiskTextCache(tmp_path, max_age_s=60)
+    cache.put("old", "receta")
+    stale = time.time() - 120
+    os.utime(tmp_path / "old", (stale, stale))
+
+    assert cache.get("old") is None
+    assert not (tmp_path / "old").exists()
+
+
+def test_disk_cache_keeps_only_newest_entries(tmp_path):
+    cache = DiskTextCache(tmp_path, max_entries=2)
+    for age, key in enumerate(("c", "b", "a")):
+        cache.put(key, key)
+        mtime = time.time() - 100 + age
+        os.utime(tmp_path / key, (mtime, mtime))
+    cache.put("d", "d")
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["a", "d"]
@@ -0,0 +1,278 @@
+"""Tests for inference image helpers."""
+
+import io
+
+import pytest
+from PIL import Image
+
+from src.inference.utils import (
+    build_warmup_generations,
+    configure_generation,
+    describe_image,
+    downscale_image_bytes,
+    open_image,
+    read_image_bytes,
+    resolve_attn_implementation,
+    resolve_quantization_mode,
+)
+
+
+def _png_bytes(mode: str = "RGB") -> bytes:
+    buffer = io.BytesIO()
+    Image.new(mode, (4, 3)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_image_inputs_from_path_bytes_and_pil_agree(tmp_path):
+    data = _png_bytes()
+    path = tmp_path / "receta.png"
+    path.write_bytes(data)
+    pil_image = Image.open(io.BytesIO(data)).convert("RGB")
+
+    assert read_image_bytes(str(path)) == data
+    assert read_image_bytes(data) is data
+    assert open_image(pil_image) is pil_image
+    assert open_image(Image.open(io.BytesIO(read_image_bytes(pil_image)))).size == (4, 3)
+    assert {open_image(img).size for img in (path, data)} == {(4, 3)}
+
+
+def test_open_image_converts_to_rgb_and_describe_never_dumps_bytes():
+    grayscale = Image.new("L", (2, 2))
+
+    assert open_image(grayscale).mode == "RGB"
+    assert describe_image(b"abc") == "<3 bytes>"
+    assert describe_image(grayscale) == "<image 2x2>"
+
+
+def test_downscale_image_bytes_caps_longest_edge():
+    buffer = io.BytesIO()
+    Image.new("RGB", (300, 400)).save(buffer, format="PNG")
+    large = buffer.getvalue()
+
+    small = downscale_image_bytes(large, max_edge=100)
+
+    assert Image.open(io.BytesIO(small)).size == (75, 100)
+    assert downscale_image_bytes(small, max_edge=100) is small
+    assert downscale_image_bytes(b"not-an-image") == b"not-an-image"
+
+
+def test_open_image_max_edge_shrinks_without_mutating_caller_image():
+    original = Image.new("RGB", (300, 400))
+    buffer = io.BytesIO()
+    original.save(buffer, format="JPEG")
+
+    assert open_image(original, max_edge=100).size == (75, 100)
+    assert original.size == (300, 400)
+    assert open_image(buffer.getvalue(), max_edge=100).size == (75, 100)
+    assert open_image(original, max_edge=1000) is original
+
+
+def test_open_image_applies_exif_orientation_like_downscale():
+    landscape = Image.new("RGB", (400, 300))
+    exif = landscape.getexif()
+    exif[0x0112] = 6  # rotate 90 degrees on display
+    buffer = io.BytesIO()
+    landscape.save(buffer, format="JPEG", exif=exif)
+    rotated = buffer.getvalue()
+
+    assert open_image(rotated).size == (300, 400)
+    assert open_image(rotated, max_edge=200).size == (150, 200)
+    downscaled = downscale_image_bytes(rotated, max_edge=200)
+    assert open_image(downscaled).size == open_image(rotated, max_edge=200).size
+
+
+def test_quantization_mode_defaults_to_bf16_and_rejects_unknown(monkeypatch):
+    monkeypatch.delenv("MEDGEMMA_QUANT", raising=False)
+    assert resolve_quantization_mode() == "bf16"
+
+    monkeypatch.setenv("MEDGEMMA_QUANT", " INT4 ")
+    assert resolve_quantization_mode() == "int4"
+
+    monkeypatch.setenv("MEDGEMMA_QUANT", "fp8")
+    with pytest.raises(ValueError, match="MEDGEMMA_QUANT"):
+        resolve_quantization_mode()
+
+
+def test_configure_generation_uses_static_cache_only_when_enabled(monkeypatch):
+    class Model:
+        def __init__(self):
+            self.generation_config = type("GenerationConfig", (), {})()
+            self.generation_config.cache_implementation = None
+
+    monkeypatch.delenv("MEDGEMMA_COMPILE", raising=False)
+    default = Model()
+    configure_generation(default)
+    assert default.generation_config.cache_implementation is None
+
+    monkeypatch.setenv("MEDGEMMA_COMPILE", "1")
+    compiled = Model()
+    configure_generation(compiled)
+    assert compiled.generation_config.cache_implementation == "static"
+
+
+def test_warmup_uses_real_prompts_and_budgets_only_when_compiling(monkeypatch):
+    from src.inference.constants import MAX_NEW_TOKENS_LABS, MAX_NEW_TOKENS_PRESCRIPTION
+    from src.prompts import LAB_RESULTS_PROMPT, PRESCRIPTION_PROMPT
+
+    monkeypatch.delenv("MEDGEMMA_COMPILE", raising=False)
+    assert [budget for _, budget in build_warmup_generations()] == [1]
+
+    monkeypatch.setenv("MEDGEMMA_COMPILE", "1")
+    generations = build_warmup_generations()
+    prompts = [messages[1]["content"][0]["text"] for messages, _ in generations]
+    assert prompts == [PRESCRIPTION_PROMPT, LAB_RESULTS_PROMPT]
+    assert [budget for _, budget in generations] == [
+        MAX_NEW_TOKENS_PRESCRIPTION,
+        MAX_NEW_TOKENS_LABS,
+    ]
+
+
+def test_configure_generation_bans_thinking_token_only_when_enabled(monkeypatch):
+    class Processor:
+        @staticmethod
+        def tokenizer(texts, add_special_tokens):
+            assert texts == ["<unused94>"] and not add_special_tokens
+            return type("Encoding", (), {"input_ids": [[94]]})()
+
+    class Model:
+        def __init__(self):
+            self.generation_config = type("GenerationConfig", (), {})()
+            self.generation_config.bad_words_ids = None
+
+    monkeypatch.delenv("MEDGEMMA_COMPILE", raising=False)
+    monkeypatch.delenv("MEDGEMMA_SKIP_THINKING", raising=False)
+    default = Model()
+    configure_generation(default, Processor())
+    assert default.generation_config.bad_words_ids is None
+
+    monkeypatch.setenv("MEDGEMMA_SKIP_THINKING", "1")
+    direct = Model()
+    configure_generation(direct, Processor())
+    assert direct.generation_config.bad_words_ids == [[94]]
+
+
+def test_attn_implementation_uses_flash_attention_only_when_opted_in(monkeypatch):
+    import importlib.util
+
+    monkeypatch.setattr(importlib.util, "find_spec", lambda name: object())
+    monkeypatch.delenv("MEDGEMMA_FLASH_ATTN", raising=False)
+    assert resolve_attn_implementation() == "sdpa"
+
+    monkeypatch.setenv("MEDGEMMA_FLASH_ATTN", "1")
+    assert resolve_attn_implementation() == "flash_attention_2"
+
+    monkeypatch.setattr(importlib.util, "find_spec", lambda name: None)
+    assert resolve_attn_implementation() == "sdpa"
+
+
+def test_modal_backend_uploads_downscaled_images():
+    from src.inference.medgemma import ModalBackend
+
+    sent = []
+
+    class Remote:
+        class extract_from_image:
+            @staticmethod
+            def remote(image_bytes, _prompt, max_new_tokens):
+                sent.append(image_bytes)
+                return "{}"
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (4000, 3000), "white").save(buffer, format="JPEG")
+    backend = ModalBackend()
+    backend._remote_model = Remote()
+
+    backend.extract_raw(buffer.getvalue(), "prompt")
+
+    with Image.open(io.BytesIO(sent[0])) as uploaded:
+        assert max(uploaded.size) <= 1568
+
+
+def test_transformers_backends_share_one_model_load(monkeypatch):
+    import sys
+    import types
+
+    from src.inference import medgemma
+
+    loads = []
+
+    class Loader:
+        @staticmethod
+        def from_pretrained(model_id, **_kwargs):
+            loads.append(model_id)
+            return types.SimpleNamespace(tokenizer=types.SimpleNamespace())
+
+    fake_transformers = types.SimpleNamespace(
+        AutoModelForImageTextToText=Loader, AutoProcessor=Loader
+    )
+    monkeypatch.setitem(sys.modules, "transformers", fake_transformers)
+    monkeypatch.setenv("HF_TOKEN", "token")
+    monkeypatch.setattr(medgemma, "model_load_kwargs", dict)
+    monkeypatch.setattr(medgemma, "configure_generation", lambda *args: None)
+    medgemma._load_local_model_unlocked.cache_clear()
+
+    first, second = medgemma.TransformersBackend(), medgemma.TransformersBackend()
+    first._load_model()
+    second._load_model()
+    medgemma._load_local_model_unlocked.cache_clear()
+
+    assert len(loads) == 2  # processor + model, loaded once
+    assert first._model is second._model
+
+
+def test_local_generate_calls_never_overlap_across_batchers(monkeypatch):
+    import sys
+    import threading
+    import time
+    import types
+    from concurrent.futures import ThreadPoolExecutor
+
+    from src.inference import medgemma
+
+    state = {"active": 0, "peak": 0, "calls": 0}
+    state_lock = threading.Lock()
+
+    class Inputs(dict):
+        def to(self, *_args, **_kwargs):
+            return self
+
+    class Processor:
+        def apply_chat_template(self, conversations, **_kwargs):
+            ids = types.SimpleNamespace(shape=(len(conversations), 3))
+            return Inputs(input_ids=ids)
+
+        def batch_decode(self, _outputs, **_kwargs):
+            return ['{"medicamentos": [], "resultados": []}']
+
+    class Outputs:
+        def __getitem__(self, _index):
+            return self
+
+    class Model:
+        device = dtype = None
+
+        def generate(self, **_kwargs):
+            with state_lock:
+                state["active"] += 1
+                state["calls"] += 1
+                state["peak"] = max(state["peak"], state["active"])
+            time.sleep(0.05)
+            with state_lock:
+                state["active"] -= 1
+            return Outputs()
+
+    fake_torch = types.SimpleNamespace(inference_mode=threading.Lock)
+    monkeypatch.setitem(sys.modules, "torch", fake_torch)
+
+    backend = medgemma.TransformersBackend()
+    backend._processor, backend._model = Processor(), Model()
+    image = _png_bytes()
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        prescription = pool.submit(backend.extract_prescription, image)
+        labs = pool.submit(backend.extract_lab_results, image)
+        prescription.result(timeout=5)
+        labs.result(timeout=5)
+
+    assert state["calls"] == 2
+    assert state["peak"] == 1
@@ -0,0 +1,43 @@
+"""Tests for the drug interaction checker."""
+
+import itertools
+
+from src.interactions import (
+    KNOWN_INTERACTIONS,
+    check_interactions,
+    normalize_drug_name,
+    order_interactions,
+)
+
+
+def test_check_interactions_resolves_brands_and_sorts_by_severity():
+    interactions = check_interactions(["Losartan", "Potasio", "Coumadin", "Aspirina"])
+
+    assert [(i.drugs, i.severity) for i in interactions] == [
+        (("Coumadin", "Aspirina"), "alta"),
+        (("Losartan", "Potasio"), "media"),
+    ]
+
+
+def test_check_interactions_matches_regardless_of_table_key_order():
+    for drug_a, drug_b in KNOWN_INTERACTIONS:
+        assert len(check_interactions([drug_a, drug_b])) == 1
+        assert len(check_interactions([drug_b, drug_a])) == 1
+
+
+def test_check_interactions_without_known_pairs():
+    assert check_interactions(["Acetaminofen", "Vitamina C"]) == []
+    assert check_interactions(["Warfarina"]) == []
+
+
+def test_normalize_drug_name_strips_suffix_and_maps_brand():
+    assert normalize_drug_name("  Glucophage Tabletas ") == "metformina"
+
+
+def test_order_interactions_matches_fresh_check_for_any_entry_order():
+    meds = ["Warfarina", "Losartan", "Aspirina", "Potasio", "Ibuprofeno"]
+    found_for_set = check_interactions(sorted(meds))
+
+    for order in itertools.permutations(meds):
+        order = list(order)
+        assert order_interactions(found_for_set, order) == check_interactions(order)
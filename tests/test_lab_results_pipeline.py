@@ -1,7 +1,10 @@
 """Unit tests for lab results pipeline helpers."""
 
 from src.models import LabResultExtraction, LabResultItem
-from src.pipelines.lab_results_pipeline import build_lab_results_output
+from src.pipelines.lab_results_pipeline import (
+    build_lab_results_output,
+    format_lab_results_table,
+)
 
 
 def test_build_lab_results_output_normal_only():
@@ -53,3 +56,24 @@ def test_build_lab_results_output_with_abnormal_values():
     assert "por encima" in output
     assert "por debajo" in output
     assert "**Aviso:**" in output
+
+
+def test_format_lab_results_table_rows_and_status_emojis():
+    table = format_lab_results_table(
+        [
+            LabResultItem(
+                nombre_prueba="Glucosa",
+                valor="140",
+                unidad="mg/dL",
+                rango_referencia="70 - 110",
+                estado="ALTO",
+            ),
+            LabResultItem(nombre_prueba="Colesterol", valor="180", estado=""),
+        ]
+    )
+
+    lines = table.splitlines()
+    assert lines[0].startswith("| Estado | Prueba |")
+    assert lines[2] == "| 🔴 | Glucosa | 140 | mg/dL | 70 - 110 |"
+    assert lines[3] == "| ⚪ | Colesterol | 180 |  |  |"
+    assert table.endswith("**Leyenda:** 🟢 Normal | 🔴 Alto | 🟡 Bajo")
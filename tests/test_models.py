@@ -0,0 +1,22 @@
+"""Tests for MedGemma extraction parsing."""
+
+from src.models import LabResultExtraction, PrescriptionExtraction
+
+
+def test_from_json_ignores_text_around_the_object():
+    wrapped = (
+        'Aquí está el resultado: {"medicamentos": [{"nombre_medicamento": "LOSARTAN"}]}'
+        " Nota: revise la dosis {si aplica}."
+    )
+
+    result = PrescriptionExtraction.from_json(wrapped)
+
+    assert result.parse_success
+    assert [m.nombre_medicamento for m in result.medicamentos] == ["LOSARTAN"]
+    assert result.raw_response == wrapped
+
+
+def test_from_json_reports_failure_for_missing_or_broken_json():
+    assert not LabResultExtraction.from_json("sin resultados").parse_success
+    assert not LabResultExtraction.from_json('{"resultados": [').parse_success
+    assert not PrescriptionExtraction.from_json('{"otro": []}').parse_success